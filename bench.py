@@ -0,0 +1,411 @@
+"""
+登录流程压测工具: 用本地模拟的 TelegramClient 替换真实客户端，通过 /ws 并发驱动登录流程。
+
+    python bench.py --flows 2000 --concurrency 500 --output result.json
+    python bench.py --flows 2000 --concurrency 500 --compare result.json
+
+服务端在独立子进程中运行 (与真实部署一致，客户端负载不会干扰服务端的事件循环延迟)，
+结果以 JSON 保存，可用 --compare 与之前版本的结果对比。
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from collections import deque
+
+# --------------------------
+# 模拟 Telegram 后端 (在服务端子进程中使用)
+# --------------------------
+class FakeUser:
+    _next_id = 1000000
+
+    def __init__(self):
+        FakeUser._next_id += 1
+        self.id = FakeUser._next_id
+        self.first_name = "Bench"
+        self.last_name = None
+        self.username = f"bench{self.id}"
+        self.phone = None
+        self.premium = False
+        self.bot = False
+
+
+class FakeQRLogin:
+    def __init__(self, client):
+        self.client = client
+        self.url = f"tg://login?token={os.urandom(24).hex()}"
+        self.expires = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=30)
+
+    async def recreate(self):
+        self.url = f"tg://login?token={os.urandom(24).hex()}"
+        self.expires = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=30)
+
+    async def wait(self, timeout=None):
+        from telethon.errors import SessionPasswordNeededError
+        delay = self.client.profile.jitter(self.client.profile.scan_delay)
+        if timeout is not None and delay > timeout:
+            await asyncio.sleep(timeout)
+            raise asyncio.TimeoutError()
+        await asyncio.sleep(delay)
+        if self.client.needs_password:
+            raise SessionPasswordNeededError(request=None)
+        self.client.authorized = True
+        return FakeUser()
+
+
+class FakeProfile:
+    """模拟后端的行为参数"""
+
+    def __init__(self, connect_latency, rpc_latency, scan_delay, flood_rate, flood_seconds, password_rate):
+        self.connect_latency = connect_latency
+        self.rpc_latency = rpc_latency
+        self.scan_delay = scan_delay
+        self.flood_rate = flood_rate
+        self.flood_seconds = flood_seconds
+        self.password_rate = password_rate
+
+    @staticmethod
+    def jitter(value):
+        return value * random.uniform(0.5, 1.5)
+
+
+class FakeTelegramClient:
+    """实现 SessionManager 用到的 TelegramClient 接口，不产生任何网络请求"""
+
+    profile = None
+
+    def __init__(self, session, api_id, api_hash, proxy=None, **kwargs):
+        self.session = session
+        self.api_id = api_id
+        self.flood_sleep_threshold = 60
+        self.authorized = False
+        self.needs_password = random.random() < self.profile.password_rate
+        self._me = None
+
+    async def connect(self):
+        from telethon.crypto import AuthKey
+        await asyncio.sleep(self.profile.jitter(self.profile.connect_latency))
+        if self.session.auth_key is None:
+            self.session.set_dc(2, "149.154.167.51", 443)
+            self.session.auth_key = AuthKey(os.urandom(256))
+
+    async def disconnect(self):
+        pass
+
+    async def is_user_authorized(self):
+        return self.authorized
+
+    async def qr_login(self):
+        await asyncio.sleep(self.profile.jitter(self.profile.rpc_latency))
+        return FakeQRLogin(self)
+
+    async def send_code_request(self, phone, **kwargs):
+        from telethon.errors import FloodWaitError
+        await asyncio.sleep(self.profile.jitter(self.profile.rpc_latency))
+        if random.random() < self.profile.flood_rate:
+            raise FloodWaitError(request=None, capture=self.profile.flood_seconds)
+
+        class SentCode:
+            phone_code_hash = os.urandom(8).hex()
+        return SentCode()
+
+    async def sign_in(self, phone=None, code=None, password=None, **kwargs):
+        from telethon.errors import SessionPasswordNeededError
+        await asyncio.sleep(self.profile.jitter(self.profile.rpc_latency))
+        if password is None and self.needs_password:
+            raise SessionPasswordNeededError(request=None)
+        self.authorized = True
+        return await self.get_me()
+
+    async def get_me(self):
+        if self._me is None:
+            self._me = FakeUser()
+        return self._me
+
+
+def read_rss_kb():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+def serve(args):
+    """服务端子进程: 加载 main 并替换 create_client，附加采样统计接口"""
+    workdir = tempfile.mkdtemp(prefix="tg-bench-")
+    # 关闭准入限制与预热，避免干扰测量
+    os.environ.update({
+        "TG_SESSIONS_DIR": workdir,
+        "TG_CATALOG_PATH": os.path.join(workdir, "catalog.db"),
+        "TG_AUTH_KEY_POOL_SIZE": "0",
+        "TG_MAX_ACTIVE_FLOWS": "0",
+        "TG_MAX_FLOWS_PER_API_ID": "0",
+        "TG_MAX_FLOWS_PER_IP": "0",
+    })
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import uvicorn
+    import main
+
+    FakeTelegramClient.profile = FakeProfile(args.connect_latency, args.rpc_latency, args.scan_delay,
+                                             args.flood_rate, args.flood_seconds, args.password_rate)
+    main.create_client = FakeTelegramClient
+
+    lag_samples = deque(maxlen=100000)
+    memory = {"baseline_kb": read_rss_kb(), "peak_kb": 0}
+
+    async def sample(interval=0.05):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(interval)
+            lag_samples.append(max(time.perf_counter() - started - interval, 0))
+            memory["peak_kb"] = max(memory["peak_kb"], read_rss_kb())
+
+    @main.app.on_event("startup")
+    async def start_sampler():
+        main.app.state.bench_sampler = asyncio.create_task(sample())
+
+    @main.app.post("/bench/reset")
+    def bench_reset():
+        lag_samples.clear()
+        memory["baseline_kb"] = memory["peak_kb"] = read_rss_kb()
+        return {"status": "ok"}
+
+    @main.app.get("/bench/stats")
+    def bench_stats():
+        phases = {}
+        for phase, series in main.LOGIN_PHASE_SECONDS._series.items():
+            if series[-1]:
+                phases[phase] = series[-2] / series[-1]
+        return {"lag": list(lag_samples), "rss_kb": read_rss_kb(), **memory, "server_phase_mean": phases}
+
+    uvicorn.run(main.app, host="127.0.0.1", port=args.port, log_level="warning", ws_max_size=16 * 1024 * 1024)
+
+# --------------------------
+# 压测驱动
+# --------------------------
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+async def drive_flow(uri, index, args, results):
+    """执行一次完整的 /ws 登录流程，记录各阶段的客户端耗时"""
+    import websockets
+    method = args.method if args.method != "mix" else random.choice(("qr", "phone"))
+    config = {
+        "api_id": str(1000 + index % args.api_ids),
+        "api_hash": "bench",
+        "proxy_enabled": False,
+        "login_method": method,
+        "qr_modes": [args.qr_mode],
+    }
+    timings = {}
+    started = time.perf_counter()
+    mark = started
+    inputs = 0
+    outcome = "error"
+    try:
+        async with websockets.connect(uri, max_size=None, open_timeout=60) as ws:
+            await ws.send(json.dumps({"type": "init", "data": config}))
+            async for raw in ws:
+                if isinstance(raw, bytes):
+                    continue
+                msg = json.loads(raw)
+                now = time.perf_counter()
+                if msg["type"] == "qr_code" and not msg.get("refreshed"):
+                    timings["connect"] = now - mark
+                    mark = now
+                elif msg["type"] == "input_required":
+                    if msg.get("field_type") == "password":
+                        timings["qr_scan" if method == "qr" else "code"] = now - mark
+                        answer = "bench-password"
+                    elif inputs == 0 and method == "phone":
+                        # 手机号登录先询问号码再连接，连接耗时从提交号码算到开始发送验证码
+                        timings["phone_prompt"] = now - mark
+                        answer = f"+1555{index:07d}"
+                    else:
+                        timings["send_code"] = now - mark
+                        answer = "12345"
+                    inputs += 1
+                    mark = time.perf_counter()
+                    await ws.send(json.dumps({"type": "input_response", "data": answer}))
+                elif msg["type"] == "session_generated":
+                    timings["finish"] = now - mark
+                    outcome = "success"
+                    break
+                elif msg["type"] in ("log", "log_batch"):
+                    entries = msg["entries"] if msg["type"] == "log_batch" else [msg]
+                    if any(e.get("level") == "error" for e in entries):
+                        outcome = "error"
+                        break
+                    if method == "phone" and any(e["text"].startswith("正在发送验证码") for e in entries):
+                        timings["connect"] = now - mark
+                        mark = now
+                elif msg["type"] == "done":
+                    break
+    except Exception as e:
+        outcome = f"exception:{type(e).__name__}"
+    timings["total"] = time.perf_counter() - started
+    results.append({"outcome": outcome, "timings": timings})
+
+
+async def run_load(args):
+    import httpx
+    base = f"http://127.0.0.1:{args.port}"
+    async with httpx.AsyncClient(base_url=base, timeout=30) as http:
+        for _ in range(100):
+            try:
+                await http.get("/api/drain")
+                break
+            except httpx.HTTPError:
+                await asyncio.sleep(0.1)
+        else:
+            raise RuntimeError("服务端未能启动")
+        await http.post("/bench/reset")
+
+        results = []
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def limited(index):
+            async with semaphore:
+                await drive_flow(f"ws://127.0.0.1:{args.port}/ws", index, args, results)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(limited(i) for i in range(args.flows)))
+        elapsed = time.perf_counter() - started
+        stats = (await http.get("/bench/stats")).json()
+
+    succeeded = [r for r in results if r["outcome"] == "success"]
+    outcomes = {}
+    for r in results:
+        outcomes[r["outcome"]] = outcomes.get(r["outcome"], 0) + 1
+    phases = {}
+    for r in succeeded:
+        for phase, seconds in r["timings"].items():
+            phases.setdefault(phase, []).append(seconds)
+    lag = stats["lag"]
+    return {
+        "flows": args.flows,
+        "succeeded": len(succeeded),
+        "outcomes": outcomes,
+        "elapsed_seconds": round(elapsed, 3),
+        "flows_per_second": round(len(succeeded) / elapsed, 2) if elapsed else None,
+        "phases_ms": {phase: {
+            "p50": round(percentile(values, 50) * 1000, 2),
+            "p99": round(percentile(values, 99) * 1000, 2),
+        } for phase, values in sorted(phases.items())},
+        "server_phase_mean_ms": {k: round(v * 1000, 2) for k, v in sorted(stats["server_phase_mean"].items())},
+        "memory": {
+            "baseline_kb": stats["baseline_kb"],
+            "peak_kb": stats["peak_kb"],
+            "per_flow_kb": round((stats["peak_kb"] - stats["baseline_kb"]) / min(args.concurrency, args.flows), 2),
+        },
+        "event_loop_lag_ms": {
+            "p50": round((percentile(lag, 50) or 0) * 1000, 2),
+            "p99": round((percentile(lag, 99) or 0) * 1000, 2),
+            "max": round(max(lag, default=0) * 1000, 2),
+        },
+    }
+
+# --------------------------
+# 结果对比
+# --------------------------
+# 指标路径 -> 数值越大越好
+COMPARED_METRICS = {
+    ("flows_per_second",): True,
+    ("memory", "per_flow_kb"): False,
+    ("event_loop_lag_ms", "p50"): False,
+    ("event_loop_lag_ms", "p99"): False,
+}
+
+
+def flatten_metrics(results):
+    metrics = {}
+    for path in COMPARED_METRICS:
+        value = results
+        for key in path:
+            value = value.get(key) if isinstance(value, dict) else None
+        metrics[path] = value
+    for phase, values in results.get("phases_ms", {}).items():
+        metrics[("phases_ms", phase, "p50")] = values["p50"]
+        metrics[("phases_ms", phase, "p99")] = values["p99"]
+    return metrics
+
+
+def compare(baseline, current):
+    """逐项打印与基线的差异"""
+    old, new = flatten_metrics(baseline["results"]), flatten_metrics(current["results"])
+    print(f"\n对比基线: {baseline.get('version')} @ {baseline.get('timestamp')}")
+    print(f"{'指标':<32}{'基线':>12}{'当前':>12}{'变化':>10}")
+    for path in new:
+        before, after = old.get(path), new[path]
+        if before is None or after is None:
+            continue
+        change = (after - before) / before * 100 if before else 0
+        better = COMPARED_METRICS.get(path, False)
+        flag = "" if abs(change) < 5 else ("+" if (change > 0) == better else "-")
+        print(f"{'.'.join(path):<32}{before:>12}{after:>12}{change:>9.1f}%{flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TG Session 登录流程压测")
+    parser.add_argument("--flows", type=int, default=1000, help="总流程数")
+    parser.add_argument("--concurrency", type=int, default=200, help="同时进行的流程数")
+    parser.add_argument("--method", choices=("qr", "phone", "mix"), default="mix")
+    parser.add_argument("--qr-mode", default="matrix", help="请求的二维码下发方式 (matrix / binary / url / png)")
+    parser.add_argument("--api-ids", type=int, default=50, help="轮流使用的 api_id 数量 (每个 api_id 的并发流程数受上限约束)")
+    parser.add_argument("--connect-latency", type=float, default=0.2, help="模拟连接耗时 (秒)")
+    parser.add_argument("--rpc-latency", type=float, default=0.05, help="模拟单次请求耗时 (秒)")
+    parser.add_argument("--scan-delay", type=float, default=1.0, help="模拟扫码耗时 (秒)")
+    parser.add_argument("--flood-rate", type=float, default=0.01, help="发送验证码触发 FloodWait 的概率")
+    parser.add_argument("--flood-seconds", type=int, default=1, help="模拟 FloodWait 的等待时间 (秒)")
+    parser.add_argument("--password-rate", type=float, default=0.2, help="账号开启两步验证的概率")
+    parser.add_argument("--port", type=int, default=18899)
+    parser.add_argument("--output", help="保存结果的 JSON 文件")
+    parser.add_argument("--compare", help="与之前保存的结果对比")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return
+
+    # 大量并发连接需要足够的文件描述符
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    server = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--serve"] + sys.argv[1:])
+    try:
+        results = asyncio.run(run_load(args))
+    finally:
+        server.terminate()
+        server.wait()
+
+    report = {
+        "version": subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True,
+                                  cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None,
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "params": {k: v for k, v in vars(args).items() if k not in ("output", "compare", "serve")},
+        "results": results,
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(json.load(f), report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,30 +1,213 @@
+import time
+# 进程启动计时起点，各阶段耗时见 /api/startup
+BOOT_STARTED = time.perf_counter()
+
 import asyncio
 import base64
+import bisect
+import csv
+import gzip
+import hashlib
+import importlib
 import io
 import json
 import logging
+import math
+import mimetypes
 import os
+import random
+import re
+import secrets
+import socket
+import sqlite3
+import struct
+import subprocess
 import sys
-import time
-import qrcode
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
-from fastapi.responses import HTMLResponse, FileResponse, JSONResponse
-from telethon import TelegramClient
-from telethon.sessions import StringSession
-from telethon.errors import SessionPasswordNeededError, PhoneCodeInvalidError
+import tarfile
+import tempfile
+import threading
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from datetime import datetime, timezone
+from functools import partial
+from urllib.parse import unquote, urlsplit
+from fastapi import FastAPI, File, Form, Request, UploadFile, WebSocket, WebSocketDisconnect
+from fastapi.responses import Response, FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.background import BackgroundTask
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("TG-Web")
 
 # --- 路径配置 ---
-# 强制指定容器内的保存路径，确保数据保存在容器里
-SESSIONS_DIR = "/app/sessions"
+# 默认使用容器内的保存路径，确保数据保存在容器里 (基准测试等场景可用 TG_SESSIONS_DIR 覆盖)
+SESSIONS_DIR = os.getenv("TG_SESSIONS_DIR", "/app/sessions")
 # 确保目录存在
 os.makedirs(SESSIONS_DIR, exist_ok=True)
+# Session 索引库 (SQLite)，记录每个 session 文件的账号信息
+CATALOG_PATH = os.getenv("TG_CATALOG_PATH", os.path.join(SESSIONS_DIR, "catalog.db"))
+# DC 地址表与账号归属 DC 的缓存文件
+DC_CACHE_PATH = os.getenv("TG_DC_CACHE_PATH", os.path.join(SESSIONS_DIR, "dc_cache.json"))
 
 app = FastAPI()
 
+# --------------------------
+# 启动计时与延迟导入
+# --------------------------
+class StartupTimeline:
+    """记录启动各阶段耗时: 串行阶段按先后打点，后台预热与按需导入单独记录"""
+
+    def __init__(self, started):
+        self.started = started
+        self._last = started
+        self.phases = []        # [(阶段, 秒)]，按顺序
+        self.background = {}    # 后台或按需完成的工作 -> 秒
+        self.ready_at = None
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.phases.append((phase, now - self._last))
+        self._last = now
+
+    def record(self, name, seconds):
+        self.background[name] = seconds
+
+    def ready(self):
+        self.mark("startup_hooks")
+        self.ready_at = time.perf_counter()
+
+    def report(self):
+        return {
+            "ready_seconds": round(self.ready_at - self.started, 4) if self.ready_at else None,
+            "phases": {name: round(seconds, 4) for name, seconds in self.phases},
+            "background": {name: round(seconds, 4) for name, seconds in self.background.items()},
+        }
+
+STARTUP = StartupTimeline(BOOT_STARTED)
+STARTUP.mark("imports")
+
+class LazyModule:
+    """首次访问属性时才导入的模块，导入耗时记入启动报告"""
+
+    # 后台预热线程与登录流程可能同时导入 telethon 的不同子模块，两边交叉持有模块锁时
+    # 其中一方会拿到尚未初始化完成的模块，因此所有延迟导入串行进行
+    _import_lock = threading.Lock()
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def load(self):
+        if self._module is None:
+            with self._import_lock:
+                if self._module is None:
+                    started = time.perf_counter()
+                    module = importlib.import_module(self._name)
+                    STARTUP.record(f"import:{self._name}", time.perf_counter() - started)
+                    self._module = module
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+# 这些模块加载较慢且只在登录流程中用到，启动后由后台预热或在首次使用时导入
+telethon = LazyModule("telethon")
+telethon_sessions = LazyModule("telethon.sessions")
+telethon_errors = LazyModule("telethon.errors")
+qrcode = LazyModule("qrcode")
+# 二维码 PNG 渲染所需的 PIL 后端，同样经由导入锁加载
+qrcode_pil = LazyModule("qrcode.image.pil")
+# 仅多进程模式的前端进程使用
+httpx = LazyModule("httpx")
+websockets = LazyModule("websockets")
+
+def error_types(names):
+    """把错误类名转换为可用于 except / isinstance 的类型元组"""
+    return tuple(getattr(telethon_errors, name) for name in names)
+
+@app.on_event("startup")
+async def mark_module_loaded():
+    # 第一个启动钩子: 此前为模块级初始化
+    STARTUP.mark("module_init")
+
+# --------------------------
+# 性能配置 (均可通过环境变量覆盖)
+# --------------------------
+# 每个 (DC, 代理) 分组预先完成握手的 auth key 数量，0 表示关闭
+AUTH_KEY_POOL_SIZE = int(os.getenv("TG_AUTH_KEY_POOL_SIZE", "2"))
+# 预备 auth key 的最长保留时间 (秒)，过期后丢弃重新生成
+AUTH_KEY_TTL = int(os.getenv("TG_AUTH_KEY_TTL", "1800"))
+# 启动时预热直连分组所用的 API 参数 (可选)
+WARMUP_API_ID = os.getenv("TG_API_ID", "")
+WARMUP_API_HASH = os.getenv("TG_API_HASH", "")
+# WebSocket 断开后登录流程的暂存时间 (秒)，期间可凭 token 重连续接
+FLOW_PARK_TTL = int(os.getenv("TG_FLOW_PARK_TTL", "300"))
+# 二维码登录的整体等待时间 (秒)，期间二维码在同一连接上自动刷新
+QR_LOGIN_TIMEOUT = int(os.getenv("TG_QR_LOGIN_TIMEOUT", "180"))
+# 距二维码过期还剩多少秒时提前刷新
+QR_REFRESH_MARGIN = int(os.getenv("TG_QR_REFRESH_MARGIN", "5"))
+# 同时进行的登录流程上限 (全局 / 每个 api_id / 每个客户端 IP)，0 表示不限制
+MAX_ACTIVE_FLOWS = int(os.getenv("TG_MAX_ACTIVE_FLOWS", "50"))
+MAX_FLOWS_PER_API_ID = int(os.getenv("TG_MAX_FLOWS_PER_API_ID", "20"))
+# 按客户端 IP 限制默认关闭: 反向代理未正确传递 X-Forwarded-For 或用户共用 NAT 出口时，
+# 所有人会被识别为同一个 IP 而互相排队；确认能取得真实 IP 后再按需开启
+MAX_FLOWS_PER_IP = int(os.getenv("TG_MAX_FLOWS_PER_IP", "0"))
+# REST API 创建的流程单独计数，默认不按 IP 限制 (脚本常从同一台机器并发创建大量流程)
+MAX_API_FLOWS_PER_IP = int(os.getenv("TG_MAX_API_FLOWS_PER_IP", "0"))
+# 各阶段的最长停留时间 (秒)，超时的流程由后台回收
+PHASE_DEADLINES = {
+    "connect": int(os.getenv("TG_CONNECT_TIMEOUT", "30")),
+    "phone": int(os.getenv("TG_PHONE_TIMEOUT", "180")),
+    "code": int(os.getenv("TG_CODE_TIMEOUT", "300")),
+    "2fa": int(os.getenv("TG_PASSWORD_TIMEOUT", "300")),
+    "qr": QR_LOGIN_TIMEOUT + 30,
+}
+# 后台回收检查间隔 (秒)
+REAPER_INTERVAL = int(os.getenv("TG_REAPER_INTERVAL", "10"))
+# 每个 WebSocket 连接积压的日志上限，浏览器接收过慢时丢弃最早的日志 (协议消息不受影响)
+WS_LOG_BUFFER = int(os.getenv("TG_WS_LOG_BUFFER", "200"))
+# DC 地址表的刷新周期 (秒)，过期后在下一次登录成功时顺带更新
+DC_OPTIONS_TTL = int(os.getenv("TG_DC_OPTIONS_TTL", "86400"))
+# 重启前等待进行中流程结束或到达可恢复检查点的最长时间 (秒)
+DRAIN_TIMEOUT = int(os.getenv("TG_DRAIN_TIMEOUT", "120"))
+# 服务端允许的二维码下发方式，按优先级排列:
+#   matrix - 模块位图，由页面在 canvas 上绘制
+#   binary - PNG 以 WebSocket 二进制帧发送
+#   url    - 仅发送 tg://login 链接，由客户端自行生成二维码
+#   png    - base64 PNG 内嵌在 JSON 中 (兼容兜底，始终可用)
+QR_MODES = [m.strip() for m in os.getenv("TG_QR_MODES", "matrix,binary,url,png").split(",") if m.strip()]
+# 服务端 API 凭据池，格式 "api_id:api_hash,api_id:api_hash"；配置后前端可不填 API 参数
+API_CREDENTIALS = [c.strip() for c in os.getenv("TG_API_CREDENTIALS", "").split(",") if c.strip()]
+# 凭据被 Telegram 判定无效时暂停使用的时长 (秒)
+CREDENTIAL_COOLDOWN = int(os.getenv("TG_CREDENTIAL_COOLDOWN", "600"))
+# 代理池，格式 "socks5://[user:pass@]host:port,http://host:port"；前端代理类型选择“代理池”时使用
+PROXY_POOL_URLS = [u.strip() for u in os.getenv("TG_PROXY_POOL", "").split(",") if u.strip()]
+# 代理健康探测间隔与超时 (秒)
+PROXY_PROBE_INTERVAL = int(os.getenv("TG_PROXY_PROBE_INTERVAL", "30"))
+PROXY_PROBE_TIMEOUT = int(os.getenv("TG_PROXY_PROBE_TIMEOUT", "5"))
+# 账号固定代理的保留时长 (秒)，超过后下次登录重新挑选
+PROXY_PIN_TTL = int(os.getenv("TG_PROXY_PIN_TTL", "86400"))
+# 遇到 FloodWait 时愿意排队等待的最长时间 (秒)，超过则直接失败
+FLOOD_WAIT_MAX = int(os.getenv("TG_FLOOD_WAIT_MAX", "300"))
+# 批量存活检测的默认并发数与单个 session 的超时 (秒)
+SESSION_CHECK_CONCURRENCY = int(os.getenv("TG_SESSION_CHECK_CONCURRENCY", "10"))
+SESSION_CHECK_TIMEOUT = int(os.getenv("TG_SESSION_CHECK_TIMEOUT", "30"))
+# 批量导入时同时进行的验证码请求数，以及相邻请求之间的随机间隔范围 (秒)
+BATCH_SEND_CONCURRENCY = int(os.getenv("TG_BATCH_SEND_CONCURRENCY", "3"))
+BATCH_MIN_GAP = float(os.getenv("TG_BATCH_MIN_GAP", "2"))
+BATCH_MAX_GAP = float(os.getenv("TG_BATCH_MAX_GAP", "6"))
+# 处理二维码渲染、文件写入等阻塞操作的线程数
+BLOCKING_WORKERS = int(os.getenv("TG_BLOCKING_WORKERS", "4"))
+# 工作进程数；大于 0 时当前进程只作为前端，把 /ws 与登录流程请求转发给各工作进程
+WORKERS = int(os.getenv("TG_WORKERS", "0"))
+# 工作进程监听 127.0.0.1 上从该端口开始的连续端口
+WORKER_BASE_PORT = int(os.getenv("TG_WORKER_BASE_PORT", "9100"))
+# 由前端进程为每个工作进程设置，流程 ID 以该编号为前缀以便前端路由
+WORKER_INDEX = os.getenv("TG_WORKER_INDEX")
+IS_FRONTEND = WORKERS > 0 and WORKER_INDEX is None
+
 # --------------------------
 # 页面配置变量
 # --------------------------
@@ -32,19 +215,129 @@ APP_VERSION = "v1.0.0 Pro"
 PERSONAL_SITE_URL = "https://github.com/xudahua520"
 AVATAR_URL = "https://q1.qlogo.cn/g?b=qq&nk=95317341&s=640" 
 
+# --------------------------
+# 静态资源
+# --------------------------
+# 本地静态资源目录 (Docker 构建时下载)，缺失的资源回退到公共 CDN
+STATIC_DIR = os.getenv("TG_STATIC_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "static"))
+# 页面引用的资源: 名称 -> (本地相对路径, CDN 地址)
+# 名称 -> (本地相对路径, CDN 地址, SRI 摘要)；样式表带摘要，无论从本地还是 CDN 加载浏览器都会校验
+STATIC_ASSETS = {
+    "bootstrap_css": ("css/bootstrap.min.css", "https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.min.css",
+                      "sha384-9ndCyUaIbzAi2FUVXJi0CjmCapSmO7SnpJef0486qhLnuZ2cdeRhO02iuK6FUUVM"),
+    "fontawesome_css": ("css/all.min.css", "https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.0.0/css/all.min.css",
+                        "sha512-9usAa10IRO0HhonpyAIVpjrylPvoDwiPUiKdWk5t3PyolY1cOd4DSE0Ga+ri4AuTroPR5aQvXU9xC6qOPnzFeg=="),
+    "favicon": ("favicon.ico", "https://telegram.org/img/favicon.ico", None),
+    "avatar": ("img/avatar.jpg", AVATAR_URL, None),
+}
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+class StaticBundle:
+    """启动时一次性载入的响应体: 预先计算强 ETag 并生成 gzip / brotli 版本"""
+
+    # 各编码版本使用不同的 ETag，避免共享缓存在 304 校验时混用不同编码的响应体
+    ETAG_SUFFIXES = {"br": "-br", "gzip": "-gz"}
+
+    # 已压缩的格式再压缩没有收益
+    COMPRESSIBLE = ("text/", "application/javascript", "application/json", "image/svg+xml", "image/x-icon",
+                    "image/vnd.microsoft.icon")
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.ready = False
+
+    def build(self, directory, render_index):
+        """载入静态文件并渲染首页，只执行一次 (在线程池中执行)"""
+        with self._lock:
+            if self.ready:
+                return
+            started = time.perf_counter()
+            self.load_dir(directory)
+            # 页面内容只随版本变化，浏览器每次用 ETag 校验，未变化时返回 304
+            self.add("/", render_index().encode("utf-8"), "text/html; charset=utf-8", "no-cache")
+            self.ready = True
+            STARTUP.record("static_build", time.perf_counter() - started)
+
+    def add(self, path, body, media_type, cache_control):
+        self._entries[path] = {
+            "body": body,
+            "media_type": media_type,
+            "cache_control": cache_control,
+            "etag": f'"{hashlib.sha256(body).hexdigest()[:32]}"',
+            "variants": {},
+        }
+
+    def load_dir(self, directory):
+        """载入目录下的全部文件，文件名带版本参数引用，可长期缓存"""
+        if not os.path.isdir(directory):
+            return
+        for root, _, files in os.walk(directory):
+            for name in files:
+                file_path = os.path.join(root, name)
+                relative = os.path.relpath(file_path, directory).replace(os.sep, "/")
+                with open(file_path, "rb") as f:
+                    body = f.read()
+                media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+                self.add(f"/static/{relative}", body, media_type, "public, max-age=31536000, immutable")
+
+    def url(self, name):
+        """页面中引用资源的地址: 本地存在时带内容哈希，否则使用 CDN"""
+        relative, cdn_url, _ = STATIC_ASSETS[name]
+        entry = self._entries.get(f"/static/{relative}")
+        if entry is None:
+            return cdn_url
+        return f"/static/{relative}?v={entry['etag'][1:9]}"
+
+    def compress_all(self):
+        """生成压缩版本，仅保留明显更小的结果 (在线程池中执行)"""
+        for entry in self._entries.values():
+            if not entry["media_type"].startswith(self.COMPRESSIBLE):
+                continue
+            body = entry["body"]
+            candidates = {"gzip": gzip.compress(body, compresslevel=9, mtime=0)}
+            if brotli is not None:
+                candidates["br"] = brotli.compress(body, quality=11)
+            entry["variants"] = {encoding: data for encoding, data in candidates.items()
+                                 if len(data) < len(body) * 0.9}
+
+    def response(self, request: Request, path):
+        entry = self._entries.get(path)
+        if entry is None:
+            return None
+        accepted = request.headers.get("accept-encoding", "")
+        encoding = next((e for e in ("br", "gzip") if e in entry["variants"] and e in accepted), None)
+        etag = entry["etag"] if encoding is None else entry["etag"][:-1] + self.ETAG_SUFFIXES[encoding] + '"'
+        headers = {"ETag": etag, "Cache-Control": entry["cache_control"], "Vary": "Accept-Encoding"}
+        if_none_match = request.headers.get("if-none-match", "")
+        if etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]:
+            return Response(status_code=304, headers=headers)
+        if encoding is None:
+            return Response(content=entry["body"], media_type=entry["media_type"], headers=headers)
+        headers["Content-Encoding"] = encoding
+        return Response(content=entry["variants"][encoding], media_type=entry["media_type"], headers=headers)
+
+STATIC = StaticBundle()
+
 # --------------------------
 # 前端 HTML
 # --------------------------
-html_content = f"""
+def render_index_page():
+    """渲染首页 HTML，引用的静态资源地址取决于已载入的本地文件"""
+    return f"""
 <!DOCTYPE html>
 <html lang="zh-CN">
 <head>
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>TG Session丨管理面板</title>
-    <link rel="icon" href="https://telegram.org/img/favicon.ico" type="image/x-icon">
-    <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.min.css" rel="stylesheet">
-    <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.0.0/css/all.min.css">
+    <link rel="icon" href="{STATIC.url('favicon')}" type="image/x-icon">
+    <link href="{STATIC.url('bootstrap_css')}" rel="stylesheet" integrity="{STATIC_ASSETS['bootstrap_css'][2]}" crossorigin="anonymous">
+    <link rel="stylesheet" href="{STATIC.url('fontawesome_css')}" integrity="{STATIC_ASSETS['fontawesome_css'][2]}" crossorigin="anonymous">
     <style>
         :root {{ 
             --primary-color: #0088cc; /* TG Blue */
@@ -335,7 +628,7 @@ html_content = f"""
             border-radius: 12px;
             position: relative;
         }}
-        .qr-container img {{ border: 8px solid #fff; border-radius: 12px; box-shadow: 0 4px 15px rgba(0,0,0,0.1); }}
+        .qr-container img, .qr-container canvas {{ border: 8px solid #fff; border-radius: 12px; box-shadow: 0 4px 15px rgba(0,0,0,0.1); }}
         
         /* 二维码过期遮罩 */
         .qr-overlay {{
@@ -420,11 +713,11 @@ html_content = f"""
                             
                             <div class="input-group mb-3">
                                 <span class="input-group-text"><i class="fas fa-id-card"></i> API ID</span>
-                                <input type="number" class="form-control" id="apiId" value="6627460" placeholder="请输入数字 ID">
+                                <input type="number" class="form-control" id="apiId" value="6627460" placeholder="数字 ID (留空使用服务端凭据池)">
                             </div>
                             <div class="input-group mb-4">
                                 <span class="input-group-text"><i class="fas fa-key"></i> API Hash</span>
-                                <input type="text" class="form-control" id="apiHash" value="27a53a0965e486a2bc1b1fcde473b1c4" placeholder="请输入 Hash">
+                                <input type="text" class="form-control" id="apiHash" value="27a53a0965e486a2bc1b1fcde473b1c4" placeholder="Hash (留空使用服务端凭据池)">
                             </div>
 
                             <label class="form-label text-muted small fw-bold d-flex justify-content-between">
@@ -439,6 +732,7 @@ html_content = f"""
                                     <option value="socks5" selected>SOCKS5</option>
                                     <option value="http">HTTP</option>
                                     <option value="socks4">SOCKS4</option>
+                                    <option value="pool">代理池</option>
                                 </select>
                                 <input type="text" class="form-control" id="proxyFull" value="192.168.2.6:7891" placeholder="IP:端口 (例如 127.0.0.1:7890)">
                             </div>
@@ -486,6 +780,7 @@ html_content = f"""
                             <h6 class="mb-3 text-dark fw-bold">请使用 Telegram 扫码</h6>
                             <div style="position: relative; display: inline-block;">
                                 <img id="qrImage" src="" alt="QR Code" width="240" height="240">
+                                <canvas id="qrCanvas" width="240" height="240" style="display:none;"></canvas>
                                 <!-- 遮罩层 -->
                                 <div id="qrOverlay" class="qr-overlay">
                                     <i class="fas fa-exclamation-circle text-danger mb-3" style="font-size: 2rem;"></i>
@@ -545,7 +840,7 @@ html_content = f"""
                 <svg viewBox="0 0 24 24"><path d="M20 4H4c-1.1 0-1.99.9-1.99 2L2 18c0 1.1.9 2 2 2h16c1.1 0 2-.9 2-2V6c0-1.1-.9-2-2-2zm0 4l-8 5-8-5V6l8 5 8-5v2z"/></svg>
             </a>
             <a href="{PERSONAL_SITE_URL}" target="_blank" class="center-avatar">
-                <img src="{AVATAR_URL}" alt="Admin">
+                <img src="{STATIC.url('avatar')}" alt="Admin">
             </a>
             <a href="https://t.me/Deva520" target="_blank" class="social-link" title="Telegram">
                 <svg viewBox="0 0 24 24"><path d="M20.665 3.717l-17.73 6.837c-1.21.486-1.203 1.161-.222 1.462l4.552 1.42 10.532-6.645c.498-.303.953-.14.579.192l-8.533 7.701h-.002l.002.001-.314 4.692c.46 0 .663-.211.921-.46l2.211-2.15 4.599 3.397c.848.467 1.457.227 1.668-.785l3.019-14.228c.309-1.239-.473-1.8-1.282-1.434z"/></svg>
@@ -567,16 +862,33 @@ html_content = f"""
     let ws = null;
     let isProcessing = false;
     let timerInterval = null;
+    let flowToken = sessionStorage.getItem('flowToken');
+    let resumeAttempts = 0;
+    const MAX_RESUME_ATTEMPTS = 30;
+    const RESUME_DELAY = 2000;
+    // 本页面支持的二维码下发方式，按优先级排列 (png 为兼容兜底)
+    const QR_MODES = ['matrix', 'binary', 'png'];
 
     // --- 重启逻辑 ---
     function restartService() {{
-        if(!confirm("确定要重启后台服务吗？\\n这将中断当前所有的操作任务。")) return;
+        if(!confirm("确定要重启后台服务吗？\\n将等待进行中的登录完成或保存进度后再重启。")) return;
         
         document.getElementById('loadingOverlay').style.display = 'flex';
         
         fetch('/api/restart', {{ method: 'POST' }})
-            .then(() => {{ setTimeout(() => {{ window.location.reload(); }}, 2000); }})
-            .catch(err => {{ setTimeout(() => {{ window.location.reload(); }}, 2000); }});
+            .then(() => waitForRestart(false))
+            .catch(() => waitForRestart(false));
+    }}
+
+    // 轮询排空状态，服务停止并重新启动后刷新页面
+    function waitForRestart(seenDown) {{
+        fetch('/api/drain')
+            .then(r => r.json())
+            .then(s => {{
+                if (seenDown && s.state === 'running') return window.location.reload();
+                setTimeout(() => waitForRestart(seenDown), 2000);
+            }})
+            .catch(() => setTimeout(() => waitForRestart(true), 2000));
     }}
 
     function addLog(msg, type = 'info') {{
@@ -653,7 +965,8 @@ html_content = f"""
         let proxyIp = '';
         let proxyPort = '';
 
-        if (document.getElementById('enableProxy').checked) {{
+        // 代理池模式下地址由服务端分配
+        if (document.getElementById('enableProxy').checked && proxyType !== 'pool') {{
             if (!proxyInput.includes(':')) {{
                 alert("代理地址格式错误，请使用 IP:端口 格式 (例如 127.0.0.1:7890)");
                 return;
@@ -670,55 +983,109 @@ html_content = f"""
             proxy_ip: proxyIp,
             proxy_port: proxyPort,
             proxy_type: proxyType,
-            login_method: method
+            login_method: method,
+            qr_modes: QR_MODES
         }};
 
-        if(!config.api_id || !config.api_hash) {{
-            alert("请填写 API ID 和 API Hash");
+        // 两项都留空时由服务端凭据池分配
+        if(!config.api_id !== !config.api_hash) {{
+            alert("请同时填写 API ID 和 API Hash，或全部留空使用服务端凭据池");
             return;
         }}
 
-        // 如果之前的 WS 还在，关闭它
-        if(ws) ws.close();
+        // 如果之前的任务还在，终止它
+        abortFlow();
+        openSocket({{type: 'init', data: config}});
+    }}
 
+    // --- 连接与断线续接 ---
+    function openSocket(firstMessage) {{
         const protocol = window.location.protocol === 'https:' ? 'wss' : 'ws';
-        ws = new WebSocket(`${{protocol}}://${{window.location.host}}/ws`);
+        const socket = new WebSocket(`${{protocol}}://${{window.location.host}}/ws`);
+        socket.binaryType = 'blob';
+        ws = socket;
 
-        ws.onopen = () => {{
+        socket.onopen = () => {{
             toggleControls(true);
-            addLog("连接服务器成功...", "info");
-            ws.send(JSON.stringify({{type: 'init', data: config}}));
+            addLog(firstMessage.type === 'resume' ? "正在恢复登录流程..." : "连接服务器成功...", "info");
+            socket.send(JSON.stringify(firstMessage));
         }};
 
-        ws.onmessage = (event) => {{
+        socket.onmessage = (event) => {{
+            // 二进制帧只用于 binary 模式的二维码图片
+            if (event.data instanceof Blob) {{
+                showQrBlob(event.data);
+                return;
+            }}
             const msg = JSON.parse(event.data);
             handleMessage(msg);
         }};
 
-        ws.onclose = () => {{
+        socket.onclose = () => {{
+            if (ws !== socket) return; // 已被新的连接替换
+            if (flowToken && resumeAttempts < MAX_RESUME_ATTEMPTS) {{
+                resumeAttempts++;
+                addLog(`连接中断，${{RESUME_DELAY / 1000}} 秒后尝试恢复 (${{resumeAttempts}}/${{MAX_RESUME_ATTEMPTS}})`, "warning");
+                setTimeout(() => {{ if (ws === socket) openSocket({{type: 'resume', token: flowToken}}); }}, RESUME_DELAY);
+                return;
+            }}
             addLog("连接已断开", "warning");
             toggleControls(false);
             clearInterval(timerInterval);
             hideInput();
         }};
         
-        ws.onerror = (e) => {{
+        socket.onerror = (e) => {{
             addLog("连接错误", "error");
-            toggleControls(false);
-        }}
+        }};
+    }}
+
+    function setFlowToken(token) {{
+        flowToken = token;
+        if (token) sessionStorage.setItem('flowToken', token);
+        else sessionStorage.removeItem('flowToken');
+    }}
+
+    function abortFlow() {{
+        const socket = ws;
+        ws = null;
+        setFlowToken(null);
+        if (!socket) return;
+        if (socket.readyState === WebSocket.OPEN) socket.send(JSON.stringify({{type: 'cancel'}}));
+        socket.close();
     }}
 
     function handleMessage(msg) {{
         switch(msg.type) {{
+            case 'flow':
+                setFlowToken(msg.token);
+                resumeAttempts = 0;
+                break;
+            case 'resumed':
+                resumeAttempts = 0;
+                addLog("已恢复登录流程", "success");
+                break;
+            case 'resume_failed':
+                setFlowToken(null);
+                addLog("登录流程已过期，请重新开始", "warning");
+                ws.close();
+                break;
+            case 'done':
+                setFlowToken(null);
+                break;
             case 'log':
                 addLog(msg.text, msg.level);
                 break;
+            case 'log_batch':
+                if (msg.dropped) addLog(`网络较慢，已省略 ${{msg.dropped}} 条日志`, 'warning');
+                msg.entries.forEach(entry => addLog(entry.text, entry.level));
+                break;
             case 'qr_code':
-                const img = document.getElementById('qrImage');
-                img.src = "data:image/png;base64," + msg.data;
+                showQr(msg);
                 document.getElementById('qrContainer').style.display = 'block';
-                startTimer(55); // 稍微少于后端的60秒，提前显示遮罩
-                addLog("二维码已生成，请扫描", "info");
+                // 后端会在过期前自动推送新二维码，倒计时仅作提示
+                startTimer(msg.expires_in || 55);
+                addLog(msg.refreshed ? "二维码已自动刷新" : "二维码已生成，请扫描", "info");
                 break;
             case 'qr_timeout':
                 clearInterval(timerInterval);
@@ -741,6 +1108,7 @@ html_content = f"""
                 document.getElementById('downloadBtn').href = "/export/" + msg.filename;
                 
                 addLog("✅ 任务完成！文件已保存。", "success");
+                setFlowToken(null);
                 ws.close();
                 break;
             case 'error':
@@ -749,6 +1117,43 @@ html_content = f"""
         }}
     }}
 
+    // --- 二维码绘制 ---
+    function showQr(msg) {{
+        const img = document.getElementById('qrImage');
+        const canvas = document.getElementById('qrCanvas');
+        const useCanvas = msg.mode === 'matrix';
+        img.style.display = useCanvas ? 'none' : 'inline';
+        canvas.style.display = useCanvas ? 'inline' : 'none';
+        if (msg.mode === 'matrix') {{
+            drawQrMatrix(canvas, msg.size, msg.bits);
+        }} else if (msg.mode === 'png') {{
+            img.src = "data:image/png;base64," + msg.data;
+        }}
+        // binary 模式: 图片紧随其后以二进制帧送达
+    }}
+
+    function drawQrMatrix(canvas, size, bits) {{
+        const bytes = atob(bits);
+        const ctx = canvas.getContext('2d');
+        const scale = Math.floor(canvas.width / size);
+        const offset = Math.floor((canvas.width - scale * size) / 2);
+        ctx.fillStyle = '#fff';
+        ctx.fillRect(0, 0, canvas.width, canvas.height);
+        ctx.fillStyle = '#000';
+        for (let i = 0; i < size * size; i++) {{
+            if (bytes.charCodeAt(i >> 3) & (0x80 >> (i & 7))) {{
+                ctx.fillRect(offset + (i % size) * scale, offset + Math.floor(i / size) * scale, scale, scale);
+            }}
+        }}
+    }}
+
+    function showQrBlob(blob) {{
+        const img = document.getElementById('qrImage');
+        if (img.dataset.objectUrl) URL.revokeObjectURL(img.dataset.objectUrl);
+        img.dataset.objectUrl = URL.createObjectURL(blob);
+        img.src = img.dataset.objectUrl;
+    }}
+
     function showInput(prompt, fieldType) {{
         const area = document.getElementById('inputArea');
         const input = document.getElementById('userInput');
@@ -781,7 +1186,7 @@ html_content = f"""
     }});
 
     function stopProcess() {{
-        if(ws) ws.close();
+        abortFlow();
         addLog("用户手动停止任务", "warning");
         toggleControls(false);
         clearInterval(timerInterval);
@@ -815,14 +1220,28 @@ html_content = f"""
         }}
         document.body.removeChild(textArea);
     }}
+
+    // 页面刷新或休眠唤醒后，自动续接未完成的流程
+    if (flowToken) openSocket({{type: 'resume', token: flowToken}});
 </script>
 </body>
 </html>
 """
 
 @app.get("/")
-async def get():
-    return HTMLResponse(html_content)
+async def get(request: Request):
+    if not STATIC.ready:
+        await run_blocking(STATIC.build, STATIC_DIR, render_index_page)
+    return STATIC.response(request, "/")
+
+@app.get("/static/{path:path}")
+async def get_static(path: str, request: Request):
+    if not STATIC.ready:
+        await run_blocking(STATIC.build, STATIC_DIR, render_index_page)
+    response = STATIC.response(request, f"/static/{path}")
+    if response is None:
+        return JSONResponse(status_code=404, content={"error": "File not found"})
+    return response
 
 # --------------------------
 # 下载接口
@@ -838,165 +1257,2829 @@ def download_file(filename: str):
 # 重启接口
 # --------------------------
 @app.post("/api/restart")
-def restart_server():
-    """触发服务器重启"""
-    asyncio.create_task(shutdown_server())
-    return JSONResponse(content={"status": "restarting"})
+async def restart_server(timeout: int = None):
+    """排空进行中的登录流程后退出进程，Docker会自动重启；进度可轮询 /api/drain"""
+    if WORKER_ROUTER:
+        await WORKER_ROUTER.broadcast("POST", "/api/restart", {"timeout": timeout} if timeout is not None else None)
+    DRAINER.start(DRAIN_TIMEOUT if timeout is None else timeout)
+    return JSONResponse(content={"status": "draining", **DRAINER.status()})
+
+# --------------------------
+# 监控指标 (Prometheus 文本格式)
+# --------------------------
+class Counter:
+    def __init__(self, name, help_text, label):
+        self.name = name
+        self.help = help_text
+        self.label = label
+        self.values = {}
+
+    def inc(self, label_value, amount=1):
+        self.values[label_value] = self.values.get(label_value, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for label_value, value in sorted(self.values.items()):
+            lines.append(f'{self.name}{{{self.label}="{label_value}"}} {value}')
+        return lines
+
+class Gauge:
+    def __init__(self, name, help_text, func=None):
+        self.name = name
+        self.help = help_text
+        self.func = func    # 提供时在抓取时计算当前值
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def render(self):
+        value = self.func() if self.func else self.value
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {value}"]
+
+class Histogram:
+    DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+    def __init__(self, name, help_text, label, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.label = label
+        self.buckets = buckets
+        self._series = {}   # label 值 -> [各桶计数..., 总和, 次数]
+
+    def observe(self, label_value, seconds):
+        series = self._series.get(label_value)
+        if series is None:
+            series = self._series[label_value] = [0] * (len(self.buckets) + 2)
+        index = bisect.bisect_left(self.buckets, seconds)
+        if index < len(self.buckets):
+            series[index] += 1
+        series[-2] += seconds
+        series[-1] += 1
+
+    @contextmanager
+    def time(self, label_value):
+        """记录代码块耗时 (无论成功与否)"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(label_value, time.perf_counter() - started)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for label_value, series in sorted(self._series.items()):
+            # 无标签的直方图只有一个序列 (label 值为 None)
+            label = f'{self.label}="{label_value}",' if self.label else ""
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{label}le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{label}le="+Inf"}} {series[-1]}')
+            suffix = f"{{{label[:-1]}}}" if label else ""
+            lines.append(f"{self.name}_sum{suffix} {series[-2]:.6f}")
+            lines.append(f"{self.name}_count{suffix} {series[-1]}")
+        return lines
+
+LOGIN_PHASE_SECONDS = Histogram(
+    "tg_login_phase_seconds", "Latency of each login step", "phase")
+LOGIN_OUTCOMES = Counter(
+    "tg_login_outcomes_total", "Finished login flows by outcome", "outcome")
+ACTIVE_WEBSOCKETS = Gauge(
+    "tg_active_websockets", "Currently open /ws connections")
+CONNECTED_CLIENTS = Gauge(
+    "tg_connected_clients", "TelegramClient instances currently connected")
+
+EVENT_LOOP_LAG_SECONDS = Histogram(
+    "tg_event_loop_lag_seconds", "Event loop scheduling delay", None,
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1))
+BLOCKING_TASKS = Gauge(
+    "tg_blocking_tasks_inflight", "CPU/disk tasks queued or running in the worker pool")
+
+METRICS = [LOGIN_PHASE_SECONDS, LOGIN_OUTCOMES, ACTIVE_WEBSOCKETS, CONNECTED_CLIENTS,
+           EVENT_LOOP_LAG_SECONDS, BLOCKING_TASKS]
+
+def render_metrics():
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+def merge_metrics(texts):
+    """合并多个进程的指标文本: 样本加上 worker 标签，同名指标的样本归到同一组 HELP/TYPE 之下"""
+    families = {}   # 指标名 -> [注释行, 样本行]
+    for worker, text in texts.items():
+        family = None
+        for line in text.splitlines():
+            if line.startswith("# "):
+                family = families.setdefault(line.split()[2], [[], []])
+                if line not in family[0]:
+                    family[0].append(line)
+            elif line and family is not None:
+                name, brace, rest = line.partition("{")
+                if brace:
+                    family[1].append(f'{name}{{worker="{worker}",{rest}')
+                else:
+                    name, _, value = line.partition(" ")
+                    family[1].append(f'{name}{{worker="{worker}"}} {value}')
+    return "".join("\n".join(headers + samples) + "\n" for headers, samples in families.values())
+
+@app.get("/metrics")
+def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+# --------------------------
+# 阻塞任务线程池
+# --------------------------
+# 二维码渲染、文件写入等 CPU / 磁盘操作放到有界线程池执行，避免阻塞事件循环
+BLOCKING_POOL = ThreadPoolExecutor(max_workers=BLOCKING_WORKERS, thread_name_prefix="tg-blocking")
+
+async def run_blocking(func, *args):
+    BLOCKING_TASKS.inc()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(BLOCKING_POOL, partial(func, *args))
+    finally:
+        BLOCKING_TASKS.dec()
+
+async def monitor_event_loop_lag(interval=0.5):
+    """定时休眠并测量实际唤醒延迟，延迟越大说明事件循环被阻塞得越久"""
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG_SECONDS.observe(None, max(time.perf_counter() - started - interval, 0))
+
+@app.on_event("startup")
+async def start_event_loop_monitor():
+    app.state.loop_monitor_task = asyncio.create_task(monitor_event_loop_lag())
+
+def render_qr_png(url):
+    """生成二维码 PNG 图片字节 (在线程池中执行)"""
+    qr = qrcode.QRCode(box_size=10, border=2)
+    qr.add_data(url)
+    qr.make(fit=True)
+    img = qr.make_image(image_factory=qrcode_pil.PilImage, fill_color="black", back_color="white")
+    
+    buf = io.BytesIO()
+    img.save(buf, format='PNG')
+    return buf.getvalue()
+
+def build_qr_matrix(url):
+    """生成二维码模块矩阵，按行优先打包成位图 (高位在前)，返回 (边长, base64)"""
+    qr = qrcode.QRCode(border=2)
+    qr.add_data(url)
+    qr.make(fit=True)
+    matrix = qr.get_matrix()
+    size = len(matrix)
+    packed = bytearray((size * size + 7) // 8)
+    for i, dark in enumerate(cell for row in matrix for cell in row):
+        if dark:
+            packed[i >> 3] |= 0x80 >> (i & 7)
+    return size, base64.b64encode(bytes(packed)).decode('ascii')
+
+def write_session_file(file_path, string_session):
+    with open(file_path, "w", encoding="utf-8") as f:
+        f.write(string_session)
+
+def metadata_path(filename):
+    """session 文件对应的元数据侧车文件: session_1_2.txt -> session_1_2.meta.json"""
+    base = filename[:-len(".txt")] if filename.endswith(".txt") else filename
+    return os.path.join(SESSIONS_DIR, base + ".meta.json")
+
+def write_metadata_file(file_path, metadata):
+    with open(file_path, "w", encoding="utf-8") as f:
+        json.dump(metadata, f, ensure_ascii=False, indent=2)
+
+def build_account_metadata(me, dc_id, generation):
+    """从 get_me() 的结果提取账号信息，连同生成时的上下文组成元数据记录"""
+    usernames = [u.username for u in (getattr(me, "usernames", None) or []) if getattr(u, "active", True)]
+    return {
+        "user_id": me.id,
+        "username": me.username,
+        "usernames": usernames,
+        "first_name": me.first_name,
+        "last_name": getattr(me, "last_name", None),
+        "phone": getattr(me, "phone", None),
+        "dc_id": dc_id,
+        "premium": bool(getattr(me, "premium", False)),
+        "bot": bool(getattr(me, "bot", False)),
+        "verified": bool(getattr(me, "verified", False)),
+        "restricted": bool(getattr(me, "restricted", False)),
+        "scam": bool(getattr(me, "scam", False)),
+        "fake": bool(getattr(me, "fake", False)),
+        "lang_code": getattr(me, "lang_code", None),
+        "generation": generation,
+    }
+
+# --------------------------
+# Session 索引库
+# --------------------------
+class SessionCatalog:
+    """SQLite 索引: 记录 session 文件对应的账号、DC、api_id 等信息，支持分页查询"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS sessions (
+            filename   TEXT PRIMARY KEY,
+            user_id    INTEGER,
+            username   TEXT,
+            dc_id      INTEGER,
+            api_id     INTEGER,
+            created_at INTEGER,
+            path       TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_sessions_user_id ON sessions(user_id);
+        CREATE INDEX IF NOT EXISTS idx_sessions_username ON sessions(username);
+        CREATE INDEX IF NOT EXISTS idx_sessions_created_at ON sessions(created_at);
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+    """
+    # 账号元数据列 (来自侧车文件)，旧库打开时自动补齐；metadata 列保存完整的元数据 JSON
+    METADATA_COLUMNS = {
+        "first_name": "TEXT",
+        "last_name": "TEXT",
+        "phone": "TEXT",
+        "premium": "INTEGER",
+        "bot": "INTEGER",
+        "login_method": "TEXT",
+        "proxy": "TEXT",
+        "duration": "REAL",
+        "metadata": "TEXT",
+    }
+    COLUMNS = ("filename", "user_id", "username", "dc_id", "api_id", "created_at", "path") + tuple(METADATA_COLUMNS)
+    FILTERS = ("user_id", "username", "dc_id", "api_id", "phone", "premium", "bot", "login_method")
+    # q 参数做子串匹配的列
+    SEARCH_COLUMNS = ("username", "first_name", "last_name", "phone")
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock:
+            self._conn.executescript(self.SCHEMA)
+            existing = {row[1] for row in self._conn.execute("PRAGMA table_info(sessions)")}
+            for column, column_type in self.METADATA_COLUMNS.items():
+                if column not in existing:
+                    self._conn.execute(f"ALTER TABLE sessions ADD COLUMN {column} {column_type}")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_phone ON sessions(phone)")
+            self._conn.commit()
+
+    @staticmethod
+    def metadata_row(metadata):
+        """元数据记录 -> 索引列"""
+        generation = metadata.get("generation") or {}
+        return {
+            "username": metadata.get("username"),
+            "first_name": metadata.get("first_name"),
+            "last_name": metadata.get("last_name"),
+            "phone": metadata.get("phone"),
+            "premium": int(bool(metadata.get("premium"))),
+            "bot": int(bool(metadata.get("bot"))),
+            "login_method": generation.get("login_method"),
+            "proxy": generation.get("proxy"),
+            "duration": generation.get("duration"),
+            "metadata": json.dumps(metadata, ensure_ascii=False),
+        }
+
+    @staticmethod
+    def _record(row):
+        record = dict(row)
+        if record.get("metadata"):
+            record["metadata"] = json.loads(record["metadata"])
+        return record
+
+    def save_session(self, filename, string_session, record, metadata=None):
+        """写入 session 文件 (及元数据侧车文件) 并登记索引，在同一事务内完成 (在线程池中执行)"""
+        file_path = os.path.join(SESSIONS_DIR, filename)
+        tmp_path = file_path + ".tmp"
+        write_session_file(tmp_path, string_session)
+        meta_path = metadata_path(filename) if metadata is not None else None
+        if meta_path:
+            write_metadata_file(meta_path + ".tmp", metadata)
+        row = dict(record, filename=filename, path=file_path)
+        if metadata is not None:
+            row.update(self.metadata_row(metadata))
+        with self._lock:
+            try:
+                self._conn.execute(
+                    f"INSERT OR REPLACE INTO sessions ({', '.join(self.COLUMNS)}) "
+                    f"VALUES ({', '.join('?' * len(self.COLUMNS))})",
+                    [row.get(c) for c in self.COLUMNS])
+                # 先落地元数据，保证出现 session 文件时其元数据已完整
+                if meta_path:
+                    os.replace(meta_path + ".tmp", meta_path)
+                os.replace(tmp_path, file_path)
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                for path in (tmp_path, meta_path and meta_path + ".tmp"):
+                    if path and os.path.exists(path):
+                        os.remove(path)
+                raise
+        return file_path
+
+    def _where(self, since, until, user_ids, filters, q=None):
+        where, params = [], []
+        if q:
+            where.append(f"({' OR '.join(f'{c} LIKE ?' for c in self.SEARCH_COLUMNS)})")
+            params.extend([f"%{q}%"] * len(self.SEARCH_COLUMNS))
+        for name in self.FILTERS:
+            if filters.get(name) is not None:
+                where.append(f"{name} = ?")
+                params.append(filters[name])
+        if user_ids:
+            where.append(f"user_id IN ({', '.join('?' * len(user_ids))})")
+            params.extend(user_ids)
+        if since is not None:
+            where.append("created_at >= ?")
+            params.append(since)
+        if until is not None:
+            where.append("created_at < ?")
+            params.append(until)
+        return where, params
+
+    def list(self, page=1, page_size=50, since=None, until=None, q=None, **filters):
+        """分页查询，按创建时间倒序；filters 为等值过滤条件，q 在用户名、姓名、手机号中做子串匹配"""
+        where, params = self._where(since, until, None, filters, q)
+        clause = f"WHERE {' AND '.join(where)}" if where else ""
+        with self._lock:
+            total = self._conn.execute(f"SELECT COUNT(*) FROM sessions {clause}", params).fetchone()[0]
+            rows = self._conn.execute(
+                f"SELECT * FROM sessions {clause} ORDER BY created_at DESC, filename LIMIT ? OFFSET ?",
+                params + [page_size, (page - 1) * page_size]).fetchall()
+        return {"total": total, "page": page, "page_size": page_size, "items": [self._record(r) for r in rows]}
+
+    def iter_records(self, since=None, until=None, user_ids=None, batch_size=500, **filters):
+        """按创建时间顺序逐批遍历匹配的记录 (键集分页)，不会一次性加载全部结果"""
+        where, params = self._where(since, until, user_ids, filters)
+        cursor = None
+        while True:
+            conditions, values = list(where), list(params)
+            if cursor:
+                conditions.append("(created_at > ? OR (created_at = ? AND filename > ?))")
+                values += [cursor[0], cursor[0], cursor[1]]
+            clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+            with self._lock:
+                rows = self._conn.execute(
+                    f"SELECT * FROM sessions {clause} ORDER BY created_at, filename LIMIT ?",
+                    values + [batch_size]).fetchall()
+            for row in rows:
+                yield self._record(row)
+            if len(rows) < batch_size:
+                return
+            cursor = (rows[-1]["created_at"], rows[-1]["filename"])
+
+    def get(self, filename):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM sessions WHERE filename = ?", (filename,)).fetchone()
+        return self._record(row) if row else None
+
+    def import_existing(self):
+        """一次性导入目录中已有的 session_*.txt 文件，返回导入数量"""
+        with self._lock:
+            if self._conn.execute("SELECT 1 FROM meta WHERE key = 'imported'").fetchone():
+                return 0
+        imported = 0
+        for entry in os.scandir(SESSIONS_DIR):
+            match = SESSION_FILE_RE.match(entry.name)
+            if not match or not entry.is_file():
+                continue
+            try:
+                with open(entry.path, encoding="utf-8") as f:
+                    dc_id = telethon_sessions.StringSession(f.read().strip()).dc_id
+            except Exception:
+                dc_id = None
+            with self._lock:
+                cursor = self._conn.execute(
+                    "INSERT OR IGNORE INTO sessions (filename, user_id, dc_id, created_at, path) VALUES (?, ?, ?, ?, ?)",
+                    (entry.name, int(match.group(1)), dc_id, int(match.group(2)), entry.path))
+                imported += cursor.rowcount
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('imported', ?)", (str(int(time.time())),))
+            self._conn.commit()
+        return imported
+
+    def import_sidecars(self):
+        """一次性把目录中已有的元数据侧车文件补录到索引，返回补录数量"""
+        with self._lock:
+            if self._conn.execute("SELECT 1 FROM meta WHERE key = 'sidecars_imported'").fetchone():
+                return 0
+        updated = 0
+        for entry in os.scandir(SESSIONS_DIR):
+            match = SESSION_META_RE.match(entry.name)
+            if not match or not entry.is_file():
+                continue
+            try:
+                with open(entry.path, encoding="utf-8") as f:
+                    row = self.metadata_row(json.load(f))
+            except (OSError, ValueError) as e:
+                logger.warning(f"读取元数据 {entry.name} 失败: {e}")
+                continue
+            with self._lock:
+                cursor = self._conn.execute(
+                    f"UPDATE sessions SET {', '.join(f'{c} = ?' for c in row)} WHERE filename = ?",
+                    list(row.values()) + [match.group(1) + ".txt"])
+                updated += cursor.rowcount
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('sidecars_imported', ?)",
+                               (str(int(time.time())),))
+            self._conn.commit()
+        return updated
+
+# session_{user_id}_{timestamp}.txt
+SESSION_FILE_RE = re.compile(r"^session_(\d+)_(\d+)\.txt$")
+# session_{user_id}_{timestamp}.meta.json
+SESSION_META_RE = re.compile(r"^(session_\d+_\d+)\.meta\.json$")
+
+CATALOG = SessionCatalog(CATALOG_PATH)
+
+@app.on_event("startup")
+async def import_existing_sessions():
+    # 多进程模式下由前端进程负责导入，避免工作进程重复扫描
+    if WORKER_INDEX is not None:
+        return
+
+    async def _import():
+        imported = await run_blocking(CATALOG.import_existing)
+        if imported:
+            logger.info(f"已导入 {imported} 个历史 session 文件到索引库")
+        backfilled = await run_blocking(CATALOG.import_sidecars)
+        if backfilled:
+            logger.info(f"已从元数据文件补录 {backfilled} 个账号信息")
+    app.state.catalog_import_task = asyncio.create_task(_import())
+
+@app.get("/api/sessions")
+def list_sessions(page: int = 1, page_size: int = 50, user_id: int = None, username: str = None,
+                  dc_id: int = None, api_id: int = None, since: int = None, until: int = None,
+                  q: str = None, phone: str = None, premium: bool = None, bot: bool = None,
+                  login_method: str = None):
+    """分页列出已生成的 session，可按用户、DC、api_id、账号元数据及创建时间 (unix 秒) 过滤，
+    q 在用户名、姓名、手机号中做子串匹配；全部为本地查询，不连接 Telegram"""
+    page = max(page, 1)
+    page_size = min(max(page_size, 1), 500)
+    return JSONResponse(content=CATALOG.list(page, page_size, since=since, until=until, q=q, user_id=user_id,
+                                             username=username, dc_id=dc_id, api_id=api_id, phone=phone,
+                                             premium=premium, bot=bot, login_method=login_method))
+
+class ArchiveSink:
+    """只追加、不可 seek 的写入端；zipfile/tarfile 写入的数据在每个条目后被取走并发送"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+ARCHIVE_FORMATS = {
+    "zip": ("application/zip", "zip"),
+    "tar.gz": ("application/gzip", "tar.gz"),
+}
+
+# --------------------------
+# Session 格式转换
+# --------------------------
+def to_telethon_sqlite(session, record):
+    """生成 Telethon 的 .session SQLite 文件内容"""
+    with tempfile.TemporaryDirectory() as tmp:
+        target = telethon_sessions.SQLiteSession(os.path.join(tmp, "convert"))
+        target.set_dc(session.dc_id, session.server_address, session.port)
+        target.auth_key = session.auth_key
+        target.save()
+        target.close()
+        with open(os.path.join(tmp, "convert.session"), "rb") as f:
+            return f.read()
+
+def to_pyrogram_string(session, record):
+    """生成 Pyrogram (v2) session 字符串: dc_id, api_id, test_mode, auth_key, user_id, is_bot"""
+    if not record.get("api_id") or not record.get("user_id"):
+        raise ValueError("Pyrogram 格式需要 api_id 和 user_id")
+    packed = struct.pack(">BI?256sQ?", session.dc_id, int(record["api_id"]), False,
+                         session.auth_key.key, int(record["user_id"]), False)
+    return base64.urlsafe_b64encode(packed).decode().rstrip("=").encode()
+
+def to_json_bundle(session, record):
+    """auth key 及连接参数的 JSON 描述，便于其它客户端库自行导入"""
+    return json.dumps({
+        "dc_id": session.dc_id,
+        "server_address": session.server_address,
+        "port": session.port,
+        "auth_key": session.auth_key.key.hex(),
+        "user_id": record.get("user_id"),
+        "api_id": record.get("api_id"),
+    }, ensure_ascii=False, indent=2).encode()
+
+# 格式 -> (文件后缀, 转换函数)
+SESSION_FORMATS = {
+    "string": (".txt", None),
+    "telethon": (".session", to_telethon_sqlite),
+    "pyrogram": (".pyrogram.txt", to_pyrogram_string),
+    "json": (".json", to_json_bundle),
+}
+
+def convert_session(record, session_format, api_id=None):
+    """读取 session 文件并转换为目标格式，返回 (文件名, 内容字节)"""
+    suffix, converter = SESSION_FORMATS[session_format]
+    with open(record["path"], "rb") as f:
+        data = f.read()
+    name = record["filename"]
+    if converter is None:
+        return name, data
+    if api_id:
+        record = dict(record, api_id=api_id)
+    session = telethon_sessions.StringSession(data.decode("utf-8").strip())
+    return name[:-len(".txt")] + suffix if name.endswith(".txt") else name + suffix, converter(session, record)
+
+def stream_session_archive(records, fmt, session_format="string", api_id=None):
+    """边读取 session 文件边生成压缩包分块，内存占用与导出数量无关 (由 StreamingResponse 在线程池中迭代)"""
+    sink = ArchiveSink()
+    if fmt == "zip":
+        # 写入端不可 seek 时 zipfile 会自动改用数据描述符，无需回写文件头
+        archive = zipfile.ZipFile(sink, "w", zipfile.ZIP_DEFLATED)
+    else:
+        archive = tarfile.open(fileobj=sink, mode="w|gz")
+    for record in records:
+        try:
+            name, data = convert_session(record, session_format, api_id)
+        except FileNotFoundError:
+            continue
+        except Exception as e:
+            logger.warning(f"转换 {record['filename']} 失败，已跳过: {e}")
+            continue
+        if fmt == "zip":
+            archive.writestr(zipfile.ZipInfo(name, time.localtime(record["created_at"])[:6]), data,
+                             zipfile.ZIP_DEFLATED)
+        else:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = record["created_at"]
+            archive.addfile(info, io.BytesIO(data))
+        chunk = sink.drain()
+        if chunk:
+            yield chunk
+    archive.close()
+    yield sink.drain()
+
+@app.get("/api/sessions/export")
+def export_sessions(format: str = "zip", since: int = None, until: int = None, user_ids: str = None,
+                    api_id: int = None, dc_id: int = None, session_format: str = "string",
+                    target_api_id: int = None):
+    """按条件批量导出 session 文件为 zip 或 tar.gz，流式生成；user_ids 为逗号分隔的用户 ID，
+    session_format 指定转换后的格式，target_api_id 覆盖写入 Pyrogram 格式的 api_id"""
+    if format not in ARCHIVE_FORMATS:
+        return JSONResponse(status_code=400, content={"error": f"不支持的格式: {format}"})
+    if session_format not in SESSION_FORMATS:
+        return JSONResponse(status_code=400, content={"error": f"不支持的 session 格式: {session_format}"})
+    try:
+        ids = [int(i) for i in user_ids.split(",") if i.strip()] if user_ids else None
+    except ValueError:
+        return JSONResponse(status_code=400, content={"error": "user_ids 格式错误"})
+    media_type, extension = ARCHIVE_FORMATS[format]
+    records = CATALOG.iter_records(since=since, until=until, user_ids=ids, api_id=api_id, dc_id=dc_id)
+    return StreamingResponse(
+        stream_session_archive(records, format, session_format, target_api_id), media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="sessions_{int(time.time())}.{extension}"'})
+
+@app.get("/api/sessions/{filename}/convert")
+def convert_single_session(filename: str, format: str = "telethon", api_id: int = None):
+    """把单个 session 转换为 telethon / pyrogram / json 格式并下载"""
+    if format not in SESSION_FORMATS:
+        return JSONResponse(status_code=400, content={"error": f"不支持的 session 格式: {format}"})
+    record = CATALOG.get(filename)
+    if record is None or not os.path.exists(record["path"]):
+        return JSONResponse(status_code=404, content={"error": "File not found"})
+    try:
+        name, data = convert_session(record, format, api_id)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    return Response(content=data, media_type="application/octet-stream",
+                    headers={"Content-Disposition": f'attachment; filename="{name}"'})
+
+@app.get("/api/sessions/{filename}")
+def get_session_info(filename: str):
+    record = CATALOG.get(filename)
+    if record is None:
+        return JSONResponse(status_code=404, content={"error": "File not found"})
+    return JSONResponse(content=record)
+
+# --------------------------
+# 客户端构建
+# --------------------------
+def build_proxy(config):
+    """根据前端配置构建 Telethon 代理字典，未启用代理时返回 None"""
+    if not config.get('proxy_enabled', False):
+        return None
+
+    # 获取协议类型，默认为 socks5
+    p_type = config.get('proxy_type', 'socks5')
+
+    # 根据不同协议构建代理字典
+    proxy = {
+        'proxy_type': p_type, # Telethon/Python-socks 接受 'socks5', 'socks4', 'http'
+        'addr': config['proxy_ip'],
+        'port': int(config['proxy_port']),
+    }
+
+    # SOCKS5 通常开启远程 DNS 解析
+    if p_type == 'socks5':
+        proxy['rdns'] = True
+    return proxy
+
+def proxy_label(proxy):
+    """代理的简短标识，用于分组统计"""
+    if not proxy:
+        return "direct"
+    return f"{proxy['proxy_type']}://{proxy['addr']}:{proxy['port']}"
+
+def create_client(session, api_id, api_hash, proxy=None, **kwargs):
+    """统一创建 TelegramClient，保证设备信息一致"""
+    return telethon.TelegramClient(
+        session,
+        int(api_id),
+        api_hash,
+        proxy=proxy,
+        device_model="TG-Session-Web",
+        system_version="Docker/Linux",
+        app_version="1.0.0",
+        **kwargs
+    )
+
+# --------------------------
+# 代理池
+# --------------------------
+class ProxyPool:
+    """后台探测代理可用性与延迟，为新连接挑选最快的健康代理，支持按账号固定代理"""
+
+    # 探测时通过代理连接的目标 (Telegram 默认 DC)
+    PROBE_TARGET = ("149.154.167.51", 443)
+    # 固定代理记录的数量上限，超出时淘汰最久未使用的账号
+    PIN_LIMIT = 10000
+
+    def __init__(self, urls, probe_interval, probe_timeout, pin_ttl):
+        self.probe_interval = probe_interval
+        self.probe_timeout = probe_timeout
+        self.pin_ttl = pin_ttl
+        self._entries = {}
+        self._pins = {}     # 账号 (手机号) -> (代理标识, 最近使用时间)，按最近使用排序
+        for url in urls:
+            proxy = self.parse(url)
+            self._entries[proxy_label(proxy)] = {
+                "proxy": proxy,
+                "healthy": True,    # 首次探测前默认可用
+                "latency": None,    # 延迟的滑动平均 (秒)
+                "probes": 0,
+                "errors": 0,
+                "consecutive_failures": 0,
+                "in_use": 0,
+            }
+
+    def __bool__(self):
+        return bool(self._entries)
+
+    @staticmethod
+    def parse(url):
+        parts = urlsplit(url if "://" in url else f"socks5://{url}")
+        proxy = {'proxy_type': parts.scheme, 'addr': parts.hostname, 'port': parts.port}
+        if parts.username:
+            proxy['username'] = unquote(parts.username)
+            proxy['password'] = unquote(parts.password or "")
+        if parts.scheme == 'socks5':
+            proxy['rdns'] = True
+        return proxy
+
+    def report(self, label, ok, latency=None):
+        """记录一次探测或真实连接的结果"""
+        entry = self._entries.get(label)
+        if entry is None:
+            return
+        entry["probes"] += 1
+        if ok:
+            entry["consecutive_failures"] = 0
+            entry["healthy"] = True
+            if latency is not None:
+                entry["latency"] = latency if entry["latency"] is None else entry["latency"] * 0.7 + latency * 0.3
+        else:
+            entry["errors"] += 1
+            entry["consecutive_failures"] += 1
+            if entry["consecutive_failures"] >= 2:
+                entry["healthy"] = False
+
+    def select(self, pin=None, exclude=()):
+        """返回 (标识, 代理字典)；指定 pin 时优先沿用该账号上次使用的健康代理"""
+        label = None
+        if pin and pin in self._pins:
+            label, used_at = self._pins.pop(pin)
+            if time.time() - used_at > self.pin_ttl:
+                label = None
+        entry = self._entries.get(label) if label else None
+        if entry is None or not entry["healthy"] or label in exclude:
+            candidates = [(e["latency"] if e["latency"] is not None else self.probe_timeout, e["in_use"], label)
+                          for label, e in self._entries.items() if e["healthy"] and label not in exclude]
+            if not candidates:
+                return None, None
+            label = min(candidates)[2]
+            entry = self._entries[label]
+        if pin:
+            self._pins[pin] = (label, time.time())
+            if len(self._pins) > self.PIN_LIMIT:
+                self._pins.pop(next(iter(self._pins)))
+        return label, entry["proxy"]
+
+    def acquire(self, label):
+        self._entries[label]["in_use"] += 1
+
+    def release(self, label):
+        self._entries[label]["in_use"] -= 1
+
+    async def _handshake(self, proxy, reader, writer):
+        """通过代理请求连接探测目标，成功返回 True"""
+        host, port = self.PROBE_TARGET
+        if proxy['proxy_type'] == 'socks5':
+            auth = 'username' in proxy
+            writer.write(b"\x05\x01" + (b"\x02" if auth else b"\x00"))
+            await writer.drain()
+            version, method = await reader.readexactly(2)
+            if version != 5 or method not in (0, 2):
+                return False
+            if method == 2:
+                user, password = proxy['username'].encode(), proxy['password'].encode()
+                writer.write(bytes([1, len(user)]) + user + bytes([len(password)]) + password)
+                await writer.drain()
+                if (await reader.readexactly(2))[1] != 0:
+                    return False
+            writer.write(b"\x05\x01\x00\x01" + socket.inet_aton(host) + port.to_bytes(2, "big"))
+            await writer.drain()
+            return (await reader.readexactly(10))[1] == 0
+        if proxy['proxy_type'] == 'http':
+            headers = f"CONNECT {host}:{port} HTTP/1.1\r\nHost: {host}:{port}\r\n"
+            if 'username' in proxy:
+                credentials = f"{proxy['username']}:{proxy.get('password', '')}".encode()
+                headers += f"Proxy-Authorization: Basic {base64.b64encode(credentials).decode()}\r\n"
+            writer.write((headers + "\r\n").encode())
+            await writer.drain()
+            status = await reader.readline()
+            return b" 200 " in status
+        # socks4 等其它类型只检测 TCP 连通性
+        return True
+
+    async def probe(self, label):
+        proxy = self._entries[label]["proxy"]
+        started = time.perf_counter()
+        writer = None
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(proxy['addr'], proxy['port']), self.probe_timeout)
+            ok = await asyncio.wait_for(self._handshake(proxy, reader, writer), self.probe_timeout)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError):
+            ok = False
+        finally:
+            if writer:
+                writer.close()
+        self.report(label, ok, time.perf_counter() - started if ok else None)
+
+    def expire_pins(self):
+        """清理超过保留时长的固定代理记录 (记录按最近使用排序，从头部开始淘汰)"""
+        deadline = time.time() - self.pin_ttl
+        while self._pins:
+            pin = next(iter(self._pins))
+            if self._pins[pin][1] > deadline:
+                break
+            del self._pins[pin]
+
+    async def maintain(self):
+        while True:
+            self.expire_pins()
+            await asyncio.gather(*(self.probe(label) for label in self._entries))
+            await asyncio.sleep(self.probe_interval)
+
+    def stats(self):
+        return {label: {
+            "healthy": e["healthy"],
+            "latency_ms": round(e["latency"] * 1000) if e["latency"] is not None else None,
+            "probes": e["probes"],
+            "errors": e["errors"],
+            "in_use": e["in_use"],
+        } for label, e in self._entries.items()}
+
+PROXY_POOL = ProxyPool(PROXY_POOL_URLS, PROXY_PROBE_INTERVAL, PROXY_PROBE_TIMEOUT, PROXY_PIN_TTL)
+
+@app.on_event("startup")
+async def start_proxy_probes():
+    if PROXY_POOL and not IS_FRONTEND:
+        app.state.proxy_probe_task = asyncio.create_task(PROXY_POOL.maintain())
+
+@app.get("/api/proxies")
+def proxy_pool_stats():
+    """代理池中各代理的健康状态、延迟与错误统计"""
+    return JSONResponse(content={"enabled": bool(PROXY_POOL), "pins": len(PROXY_POOL._pins), "proxies": PROXY_POOL.stats()})
+
+# --------------------------
+# DC 缓存
+# --------------------------
+# 新建 auth key 所在的默认 DC，与 Telethon 的 DEFAULT_DC_ID 一致
+DEFAULT_DC_ID = 2
+
+class DcCache:
+    """持久化的 DC 地址表，以及从历史登录中学到的 手机号 / 号段 / user_id -> 归属 DC，
+    新流程直接连接账号所在的 DC，省去 PhoneMigrate 重定向带来的第二次连接与握手。
+    手机号只以加盐哈希保存，号段只保存各 DC 的计数，缓存文件中不出现完整号码"""
+
+    # 生产环境各 DC 的 IPv4 地址，未取得 GetConfig 结果前使用
+    DEFAULT_OPTIONS = {
+        1: ("149.154.175.53", 443),
+        2: ("149.154.167.51", 443),
+        3: ("149.154.175.100", 443),
+        4: ("149.154.167.91", 443),
+        5: ("91.108.56.130", 443),
+    }
+    # 号段预测: 依次尝试的前缀长度、最少样本数与最低占比
+    PREFIX_LENGTHS = (5, 4, 3, 2, 1)
+    PREFIX_MIN_SAMPLES = 3
+    PREFIX_MIN_SHARE = 0.6
+
+    def __init__(self, path, options_ttl):
+        self.path = path
+        self.options_ttl = options_ttl
+        self.options = dict(self.DEFAULT_OPTIONS)
+        self.options_updated_at = 0
+        self.options_checked_at = 0
+        self.salt = secrets.token_hex(16)
+        self.phones = {}        # 手机号的加盐哈希 -> DC
+        self.users = {}         # user_id -> DC
+        self._prefixes = {}     # 号段 -> {DC: 次数}
+        self._dirty = False
+        self.predictions = 0
+        self.prediction_hits = 0
+
+    @staticmethod
+    def normalize(phone):
+        return re.sub(r"\D", "", phone or "")
+
+    def load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except ValueError:
+            logger.warning("DC 缓存文件损坏，已忽略")
+            return
+        self.options.update({int(dc): tuple(address) for dc, address in data.get("options", {}).items()})
+        self.options_updated_at = data.get("options_updated_at", 0)
+        self.users = {int(user_id): dc for user_id, dc in data.get("users", {}).items()}
+        if "salt" in data:
+            self.salt = data["salt"]
+            self.phones = dict(data.get("phones", {}))
+            self._prefixes = {
+                prefix: {int(dc): count for dc, count in counts.items()}
+                for prefix, counts in data.get("prefixes", {}).items()
+            }
+        else:
+            # 旧格式以明文手机号为键: 转换为哈希与号段计数，并尽快重写文件
+            for phone, dc in data.get("phones", {}).items():
+                self._learn_phone(phone, dc)
+            self._dirty = bool(self.phones)
+
+    def save(self):
+        """原子写入缓存文件 (在线程池中执行)"""
+        self._dirty = False
+        data = {
+            "options": {str(dc): list(address) for dc, address in self.options.items()},
+            "options_updated_at": self.options_updated_at,
+            "salt": self.salt,
+            "phones": dict(self.phones),
+            "prefixes": {
+                prefix: {str(dc): count for dc, count in counts.items() if count}
+                for prefix, counts in self._prefixes.items()
+            },
+            "users": {str(user_id): dc for user_id, dc in self.users.items()},
+        }
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
+
+    def _phone_key(self, phone):
+        return hashlib.sha256((self.salt + phone).encode()).hexdigest()
+
+    def _learn_phone(self, phone, dc_id):
+        key = self._phone_key(phone)
+        previous = self.phones.get(key)
+        if previous == dc_id:
+            return
+        for length in self.PREFIX_LENGTHS:
+            counts = self._prefixes.setdefault(phone[:length], {})
+            if counts.get(previous):
+                counts[previous] -= 1
+            counts[dc_id] = counts.get(dc_id, 0) + 1
+        self.phones[key] = dc_id
+
+    def learn(self, phone=None, user_id=None, dc_id=None):
+        """记录账号所在的 DC (发送验证码或登录成功后调用)"""
+        if not dc_id:
+            return
+        phone = self.normalize(phone)
+        if phone:
+            self._learn_phone(phone, dc_id)
+        if user_id:
+            self.users[user_id] = dc_id
+        self._dirty = True
+
+    def predict(self, phone=None, user_id=None):
+        """推测账号所在的 DC: 同一用户或手机号 > 样本充足且占多数的号段；无法判断时返回 None"""
+        if user_id in self.users:
+            return self.users[user_id]
+        phone = self.normalize(phone)
+        if not phone:
+            return None
+        key = self._phone_key(phone)
+        if key in self.phones:
+            return self.phones[key]
+        for length in self.PREFIX_LENGTHS:
+            counts = self._prefixes.get(phone[:length])
+            if not counts:
+                continue
+            total = sum(counts.values())
+            dc_id, count = max(counts.items(), key=lambda item: item[1])
+            if total >= self.PREFIX_MIN_SAMPLES and count / total >= self.PREFIX_MIN_SHARE:
+                return dc_id
+        return None
+
+    def record_prediction(self, predicted, actual):
+        if predicted is None:
+            return
+        self.predictions += 1
+        if predicted == actual:
+            self.prediction_hits += 1
+
+    def new_session(self, dc_id=None):
+        """创建指向指定 DC 的空 StringSession；未指定或地址未知时由 Telethon 使用默认 DC"""
+        session = telethon_sessions.StringSession()
+        if dc_id and dc_id in self.options:
+            ip, port = self.options[dc_id]
+            session.set_dc(dc_id, ip, port)
+        return session
+
+    def options_stale(self):
+        now = time.time()
+        return now - self.options_updated_at > self.options_ttl and now - self.options_checked_at > 600
+
+    async def refresh_options(self, client):
+        """通过已连接的客户端获取最新的 DC 地址表 (仅 IPv4、非 CDN、非媒体专用)"""
+        self.options_checked_at = time.time()
+        config = await client(telethon.functions.help.GetConfigRequest())
+        options = {}
+        for option in config.dc_options:
+            if option.ipv6 or option.cdn or option.media_only or option.tcpo_only:
+                continue
+            options.setdefault(option.id, (option.ip_address, option.port))
+        if options:
+            self.options.update(options)
+            self.options_updated_at = time.time()
+            self._dirty = True
+
+    async def maintain(self, interval=30):
+        """定期把新学到的记录写回磁盘"""
+        while True:
+            await asyncio.sleep(interval)
+            if self._dirty:
+                await run_blocking(self.save)
+
+    def stats(self):
+        return {
+            "options": {dc: f"{ip}:{port}" for dc, (ip, port) in sorted(self.options.items())},
+            "options_updated_at": self.options_updated_at or None,
+            "phones": len(self.phones),
+            "users": len(self.users),
+            "predictions": self.predictions,
+            "prediction_hits": self.prediction_hits,
+        }
+
+DC_CACHE = DcCache(DC_CACHE_PATH, DC_OPTIONS_TTL)
+
+@app.on_event("startup")
+async def start_dc_cache():
+    if IS_FRONTEND:
+        return
+    await run_blocking(DC_CACHE.load)
+    # 旧格式文件中的明文手机号在加载时已转换，立即重写
+    await save_dc_cache()
+    app.state.dc_cache_task = asyncio.create_task(DC_CACHE.maintain())
+
+@app.on_event("shutdown")
+async def save_dc_cache():
+    if DC_CACHE._dirty:
+        await run_blocking(DC_CACHE.save)
+
+@app.get("/api/dc-cache")
+def dc_cache_stats(phone: str = None, user_id: int = None):
+    """DC 地址表与归属 DC 记录概况；提供 phone 或 user_id 时返回预测的 DC"""
+    content = DC_CACHE.stats()
+    if phone or user_id:
+        content["predicted_dc"] = DC_CACHE.predict(phone, user_id)
+    return JSONResponse(content=content)
+
+# --------------------------
+# Auth Key 预备池
+# --------------------------
+
+class AuthKeyPool:
+    """按 (DC, 代理配置) 分组，后台预先完成 DH 握手并缓存未登录的 auth key"""
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self._keys = {}        # bucket -> deque[(生成时间, session 字符串)]
+        self._targets = {}     # bucket -> (api_id, api_hash, proxy, DC)，补充时使用
+        self._refilling = {}   # bucket -> 正在执行的补充任务
+        self._last_used = {}   # bucket -> 最近一次查找时间，长期无人使用的分组会被移除
+        self._pinned = set()   # 启动预热登记的分组，始终保持
+        self.hits = 0
+        self.misses = 0
+        self.refills = 0
+        self.refill_failures = 0
+        self.refill_seconds_total = 0.0
+        self.refill_seconds_last = 0.0
+
+    @staticmethod
+    def bucket(proxy, dc_id=DEFAULT_DC_ID):
+        return (dc_id, proxy_label(proxy))
+
+    def register(self, api_id, api_hash, proxy=None, dc_id=DEFAULT_DC_ID, pinned=False):
+        """登记一个需要保持预热的分组；已登记的分组沿用原有的 api 凭据"""
+        if self.size <= 0:
+            return None
+        bucket = self.bucket(proxy, dc_id)
+        self._targets.setdefault(bucket, (int(api_id), api_hash, proxy, dc_id))
+        self._last_used.setdefault(bucket, time.time())
+        if pinned:
+            self._pinned.add(bucket)
+        self._schedule_refill(bucket)
+        return bucket
+
+    def acquire(self, api_id, api_hash, proxy=None, dc_id=DEFAULT_DC_ID, keep_warm=False):
+        """取出一个可用的 auth key (StringSession 字符串)，池为空时返回 None。
+        只有 keep_warm (预热配置的直连或代理池中的代理) 的分组才会登记并在后台补充，
+        用户自带的代理不在此列，避免为每个提交过的代理长期握手"""
+        if self.size <= 0:
+            return None
+        bucket = self.bucket(proxy, dc_id)
+        now = time.time()
+        if keep_warm or bucket in self._targets:
+            self.register(api_id, api_hash, proxy, dc_id)
+            self._last_used[bucket] = now
+        keys = self._keys.get(bucket)
+        while keys:
+            created_at, session_string = keys.popleft()
+            if now - created_at < self.ttl:
+                self.hits += 1
+                return session_string
+        self.misses += 1
+        return None
+
+    def _schedule_refill(self, bucket):
+        task = self._refilling.get(bucket)
+        if task and not task.done():
+            return
+        self._refilling[bucket] = asyncio.create_task(self._refill(bucket))
+
+    async def _refill(self, bucket):
+        api_id, api_hash, proxy, dc_id = self._targets[bucket]
+        keys = self._keys.setdefault(bucket, deque())
+        while len(keys) < self.size:
+            started = time.perf_counter()
+            client = create_client(DC_CACHE.new_session(dc_id), api_id, api_hash, proxy)
+            try:
+                await client.connect()
+                session_string = client.session.save()
+            except Exception as e:
+                self.refill_failures += 1
+                logger.warning(f"Auth key 预生成失败 {bucket}: {e}")
+                return
+            finally:
+                await client.disconnect()
+            elapsed = time.perf_counter() - started
+            self.refills += 1
+            self.refill_seconds_total += elapsed
+            self.refill_seconds_last = elapsed
+            keys.append((time.time(), session_string))
+
+    def _drop(self, bucket):
+        self._targets.pop(bucket, None)
+        self._keys.pop(bucket, None)
+        self._last_used.pop(bucket, None)
+        task = self._refilling.pop(bucket, None)
+        if task and not task.done():
+            task.cancel()
+
+    async def maintain(self, interval=60):
+        """定期丢弃过期的 key、移除 TTL 内无人查找的分组，并补足其余分组"""
+        while True:
+            now = time.time()
+            for bucket, used_at in list(self._last_used.items()):
+                if bucket not in self._pinned and now - used_at >= self.ttl:
+                    self._drop(bucket)
+            for bucket, keys in self._keys.items():
+                while keys and now - keys[0][0] >= self.ttl:
+                    keys.popleft()
+            for bucket in list(self._targets):
+                self._schedule_refill(bucket)
+            await asyncio.sleep(interval)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            "refills": self.refills,
+            "refill_failures": self.refill_failures,
+            "refill_latency_avg": round(self.refill_seconds_total / self.refills, 3) if self.refills else None,
+            "refill_latency_last": round(self.refill_seconds_last, 3),
+            "ready": {f"dc{dc}/{route}": len(keys) for (dc, route), keys in self._keys.items()},
+        }
+
+AUTH_KEY_POOL = AuthKeyPool(AUTH_KEY_POOL_SIZE, AUTH_KEY_TTL)
+
+@app.on_event("startup")
+async def start_auth_key_pool():
+    if AUTH_KEY_POOL.size <= 0 or IS_FRONTEND:
+        return
+    if WARMUP_API_ID and WARMUP_API_HASH:
+        AUTH_KEY_POOL.register(WARMUP_API_ID, WARMUP_API_HASH, pinned=True)
+    app.state.auth_key_pool_task = asyncio.create_task(AUTH_KEY_POOL.maintain())
+
+@app.get("/api/auth-key-pool")
+def auth_key_pool_stats():
+    """预备池命中率与补充耗时，用于评估池大小"""
+    return JSONResponse(content=AUTH_KEY_POOL.stats())
+
+# --------------------------
+# FloodWait 调度
+# --------------------------
+class FloodWaitTooLong(Exception):
+    def __init__(self, seconds):
+        super().__init__(f"Telegram 要求等待 {seconds} 秒，超过允许的最长等待时间，请稍后再试")
+        self.seconds = seconds
+
+class FloodWaitScheduler:
+    """集中记录各 api_id / 代理 / 手机号的 FloodWait 截止时间，等待结束后自动重试请求"""
+
+    def __init__(self, max_wait, max_attempts=3):
+        self.max_wait = max_wait
+        self.max_attempts = max_attempts
+        self._until = {}    # (维度, 值) -> 可再次请求的时间
+        self.counts = {}    # (维度, 值) -> 累计 FloodWait 次数
+        self.flood_waits = 0
+        self.delayed_calls = 0
+        self.rejected_calls = 0
+
+    def remaining(self, keys):
+        now = time.time()
+        return max([self._until.get(key, 0) - now for key in keys] + [0])
+
+    def record(self, scope, seconds):
+        self.flood_waits += 1
+        until = time.time() + seconds
+        for key in scope:
+            self._until[key] = max(self._until.get(key, 0), until)
+            self.counts[key] = self.counts.get(key, 0) + 1
 
-async def shutdown_server():
-    """延迟1秒后退出进程，Docker会自动重启"""
-    await asyncio.sleep(1)
-    os._exit(0)
+    async def call(self, keys, func, notify=None, scope=None):
+        """等待 keys 中各维度的限制解除后执行 func()；遇到 FloodWait 时只记在错误所属的
+        scope 维度上 (默认 keys[0]) 后重试。最终仍失败时异常带上 flood_scope 供调用方区分"""
+        scope = scope or keys[:1]
+        for attempt in range(self.max_attempts):
+            wait = math.ceil(self.remaining(keys))
+            if wait > self.max_wait:
+                self.rejected_calls += 1
+                raise FloodWaitTooLong(wait)
+            if wait > 0:
+                self.delayed_calls += 1
+                if notify:
+                    await notify(wait)
+                await asyncio.sleep(wait)
+            try:
+                return await func()
+            except telethon_errors.FloodWaitError as e:
+                self.record(scope, e.seconds)
+                if attempt == self.max_attempts - 1:
+                    e.flood_scope = scope[0][0]
+                    raise
+
+    def stats(self):
+        now = time.time()
+        for key in [k for k, until in self._until.items() if until <= now]:
+            del self._until[key]
+        return {
+            "flood_waits": self.flood_waits,
+            "delayed_calls": self.delayed_calls,
+            "rejected_calls": self.rejected_calls,
+            "active": {f"{dim}:{value}": int(until - now) for (dim, value), until in self._until.items()},
+        }
+
+FLOOD_WAITS = FloodWaitScheduler(FLOOD_WAIT_MAX)
+
+METRICS.append(Gauge("tg_flood_wait_delayed_calls", "Calls delayed by the FloodWait scheduler",
+                     lambda: FLOOD_WAITS.delayed_calls))
+
+@app.get("/api/flood-waits")
+def flood_wait_stats():
+    """当前生效的 FloodWait 限制及调度统计"""
+    return JSONResponse(content=FLOOD_WAITS.stats())
+
+# --------------------------
+# API 凭据池
+# --------------------------
+class CredentialPool:
+    """多组 api_id / api_hash 分摊流量: 分配当前负载最低的健康凭据，被限流或判定无效时暂时移出轮换"""
+
+    # 说明凭据本身不可用的错误，出现一次即暂停
+    FATAL_ERRORS = ("ApiIdInvalidError", "ApiIdPublishedFloodError")
+
+    def __init__(self, credentials, cooldown):
+        self.cooldown = cooldown
+        self._entries = {}
+        for item in credentials:
+            api_id, _, api_hash = item.partition(":")
+            self._entries[api_id.strip()] = {
+                "api_hash": api_hash.strip(),
+                "in_use": 0,
+                "assigned": 0,
+                "errors": 0,
+                "disabled_until": 0,
+            }
+
+    def __bool__(self):
+        return bool(self._entries)
+
+    def _healthy(self, api_id, entry, now):
+        # FloodWait 由调度器记录，仍在限制期内的凭据不参与分配
+        return entry["disabled_until"] <= now and FLOOD_WAITS.remaining([("api_id", api_id)]) <= 0
+
+    def acquire(self):
+        """返回 (api_id, api_hash)；没有健康凭据时返回 None"""
+        now = time.time()
+        candidates = [(e["in_use"], e["assigned"], api_id) for api_id, e in self._entries.items()
+                      if self._healthy(api_id, e, now)]
+        if not candidates:
+            return None
+        api_id = min(candidates)[2]
+        entry = self._entries[api_id]
+        entry["in_use"] += 1
+        entry["assigned"] += 1
+        return api_id, entry["api_hash"]
+
+    def release(self, api_id, error=None):
+        entry = self._entries[api_id]
+        entry["in_use"] -= 1
+        if error is None:
+            return
+        entry["errors"] += 1
+        if isinstance(error, telethon_errors.FloodWaitError):
+            # 调度器已记在 api_id 上的无需重复；针对手机号的限流与凭据无关；
+            # 未经调度器的请求 (flood_scope 缺失) 按应用级限流处理，在限制期内移出轮换
+            if getattr(error, "flood_scope", None) is None:
+                FLOOD_WAITS.record([("api_id", api_id)], error.seconds)
+                logger.warning(f"API 凭据 {api_id} 触发 FloodWait，{error.seconds} 秒内不再分配")
+        elif isinstance(error, error_types(self.FATAL_ERRORS)):
+            entry["disabled_until"] = time.time() + self.cooldown
+            logger.warning(f"API 凭据 {api_id} 暂停使用 {self.cooldown} 秒: {error}")
+
+    def stats(self):
+        now = time.time()
+        return {api_id: {
+            "healthy": self._healthy(api_id, e, now),
+            "in_use": e["in_use"],
+            "assigned": e["assigned"],
+            "errors": e["errors"],
+            "flood_waits": FLOOD_WAITS.counts.get(("api_id", api_id), 0),
+            "disabled_for": max(int(e["disabled_until"] - now), 0),
+        } for api_id, e in self._entries.items()}
+
+CREDENTIALS = CredentialPool(API_CREDENTIALS, CREDENTIAL_COOLDOWN)
+
+@app.get("/api/credentials")
+def credential_stats():
+    """凭据池中各 api_id 的负载与健康状态 (不含 api_hash)"""
+    return JSONResponse(content={"enabled": bool(CREDENTIALS), "credentials": CREDENTIALS.stats()})
+
+# --------------------------
+# 并发准入控制
+# --------------------------
+class AdmissionController:
+    """限制全局 / 每个 api_id / 每个客户端 IP 的并发流程数，超出上限的按到达顺序排队"""
+
+    def __init__(self, limits):
+        self.limits = limits    # 维度 -> 上限，0 表示不限制
+        self._active = {}       # (维度, 值) -> 当前占用数
+        self._queue = []        # 排队中的请求，按到达顺序
+        self._hold_avg = 30.0   # 单个流程平均占用时长 (秒)，用于估算等待时间
+        self.admitted = 0
+        self.queued = 0
+
+    def _fits(self, keys):
+        return all(
+            not self.limits[dim] or self._active.get((dim, value), 0) < self.limits[dim]
+            for dim, value in keys
+        )
+
+    def _dispatch(self):
+        """按排队顺序放行当前能容纳的请求；被单个 IP / api_id 上限卡住的请求不阻塞其他人"""
+        for ticket in list(self._queue):
+            if self._fits(ticket["keys"]):
+                self._queue.remove(ticket)
+                for key in ticket["keys"]:
+                    self._active[key] = self._active.get(key, 0) + 1
+                ticket["started"] = time.time()
+                ticket["future"].set_result(True)
+                self.admitted += 1
+
+    def blocking(self, keys):
+        """返回已达上限、导致排队的维度"""
+        return [(dim, value) for dim, value in keys
+                if self.limits[dim] and self._active.get((dim, value), 0) >= self.limits[dim]]
+
+    def estimate_wait(self, position):
+        slots = self.limits["global"] or 1
+        return int(math.ceil(position / slots) * self._hold_avg)
+
+    async def acquire(self, api_id, ip, notify=None, ip_dimension="ip"):
+        """获取运行许可；排队期间通过 notify(位置, 预计等待秒数) 推送进度。
+        ip_dimension 指定客户端 IP 计入的维度，REST API 流程使用独立的 "api_ip" 上限"""
+        ticket = {
+            # 值为 None 的维度不参与限制 (例如批量导入的流程没有客户端 IP)
+            "keys": tuple(k for k in (("global", "*"), ("api_id", str(api_id)), (ip_dimension, ip))
+                          if k[1] is not None),
+            "future": asyncio.get_running_loop().create_future(),
+        }
+        self._queue.append(ticket)
+        self._dispatch()
+        if not ticket["future"].done():
+            self.queued += 1
+            reasons = ", ".join(f"{dim}={value}" for dim, value in self.blocking(ticket["keys"]))
+            logger.info(f"登录流程排队中，已达并发上限: {reasons or '排在前面的请求'}")
+        last_position = None
+        try:
+            while not ticket["future"].done():
+                position = self._queue.index(ticket) + 1
+                if notify and position != last_position:
+                    last_position = position
+                    await notify(position, self.estimate_wait(position))
+                try:
+                    await asyncio.wait_for(asyncio.shield(ticket["future"]), timeout=2)
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            # 排队中被取消: 已放行则归还名额，否则移出队列
+            if ticket["future"].done():
+                self.release(ticket)
+            else:
+                self._queue.remove(ticket)
+            raise
+        return ticket
+
+    def release(self, ticket):
+        for key in ticket["keys"]:
+            self._active[key] -= 1
+            if not self._active[key]:
+                del self._active[key]
+        held = time.time() - ticket["started"]
+        self._hold_avg = self._hold_avg * 0.9 + held * 0.1
+        self._dispatch()
+
+    def stats(self):
+        return {
+            "limits": self.limits,
+            "active": self._active.get(("global", "*"), 0),
+            "queued_now": len(self._queue),
+            "admitted": self.admitted,
+            "queued_total": self.queued,
+            "avg_hold_seconds": round(self._hold_avg, 1),
+        }
+
+ADMISSION = AdmissionController({
+    "global": MAX_ACTIVE_FLOWS,
+    "api_id": MAX_FLOWS_PER_API_ID,
+    "ip": MAX_FLOWS_PER_IP,
+    "api_ip": MAX_API_FLOWS_PER_IP,
+})
+
+METRICS += [
+    Gauge("tg_admission_active", "Flows holding an admission permit",
+          lambda: ADMISSION.stats()["active"]),
+    Gauge("tg_admission_queued", "Flows waiting for an admission permit",
+          lambda: ADMISSION.stats()["queued_now"]),
+    Gauge("tg_auth_key_pool_hits", "Auth key pool hits since start", lambda: AUTH_KEY_POOL.hits),
+    Gauge("tg_auth_key_pool_misses", "Auth key pool misses since start", lambda: AUTH_KEY_POOL.misses),
+]
+
+@app.get("/api/admission")
+def admission_stats():
+    """并发占用与排队情况"""
+    return JSONResponse(content=ADMISSION.stats())
+
+# --------------------------
+# Session 批量存活检测
+# --------------------------
+# 视为已失效的错误: 授权被撤销、账号被封禁或注销
+REVOKED_ERRORS = ("AuthKeyUnregisteredError", "SessionRevokedError", "SessionExpiredError",
+                  "UserDeactivatedError", "UserDeactivatedBanError", "AuthKeyDuplicatedError")
+
+def list_session_files(filenames=None):
+    """返回按 DC 排序的 [(filename, user_id, dc_id, session 字符串)]；排序只让结果按 DC 聚集，
+    每个 session 持有各自的 auth key，检测时仍各自建立连接"""
+    wanted = set(filenames) if filenames else None
+    entries = []
+    for entry in os.scandir(SESSIONS_DIR):
+        match = SESSION_FILE_RE.match(entry.name)
+        if not match or (wanted is not None and entry.name not in wanted):
+            continue
+        with open(entry.path, encoding="utf-8") as f:
+            saved = f.read().strip()
+        try:
+            dc_id = telethon_sessions.StringSession(saved).dc_id
+        except Exception:
+            dc_id = None
+        entries.append((entry.name, int(match.group(1)), dc_id, saved))
+    entries.sort(key=lambda e: (e[2] or 0, e[0]))
+    return entries
+
+async def check_session(saved, api_id, api_hash, proxy):
+    """为单个 session 新建客户端，连接并调用 get_me，返回 (状态, 详情)"""
+    client = None
+    try:
+        client = create_client(telethon_sessions.StringSession(saved), api_id, api_hash, proxy)
+        await asyncio.wait_for(client.connect(), SESSION_CHECK_TIMEOUT)
+        me = await asyncio.wait_for(client.get_me(), SESSION_CHECK_TIMEOUT)
+        if me is None:
+            return "revoked", "unauthorized"
+        return "alive", f"@{me.username}" if me.username else str(me.id)
+    except telethon_errors.FloodWaitError as e:
+        return "flood_limited", f"wait {e.seconds}s"
+    except error_types(REVOKED_ERRORS) as e:
+        return "revoked", type(e).__name__
+    except Exception as e:
+        return "error", f"{type(e).__name__}: {e}"
+    finally:
+        if client:
+            await client.disconnect()
+
+async def check_sessions(entries, api_id, api_hash, proxy, concurrency):
+    """以有限并发检测一批 session，按完成顺序逐个产出结果"""
+    pending = deque(entries)
+    results = asyncio.Queue()
+
+    async def worker():
+        while pending:
+            filename, user_id, dc_id, saved = pending.popleft()
+            # 任何异常都要产出一条结果，否则汇总端会一直等待
+            try:
+                status, detail = await check_session(saved, api_id, api_hash, proxy)
+            except Exception as e:
+                status, detail = "error", f"{type(e).__name__}: {e}"
+            await results.put({"type": "result", "filename": filename, "user_id": user_id,
+                               "dc_id": dc_id, "status": status, "detail": detail})
+
+    workers = [asyncio.create_task(worker()) for _ in range(min(concurrency, len(entries)))]
+    try:
+        for _ in range(len(entries)):
+            yield await results.get()
+    finally:
+        for task in workers:
+            task.cancel()
+
+@app.post("/api/sessions/check")
+async def check_sessions_endpoint(payload: dict):
+    """批量检测 session 是否仍然有效，以 NDJSON 流式返回每条结果和最终统计
+
+    参数与登录时相同 (api_id / api_hash / 代理配置)，另可指定 concurrency 与 filenames。
+    """
+    api_id, api_hash = payload.get('api_id'), payload.get('api_hash')
+    if not api_id or not api_hash:
+        credential = CREDENTIALS.acquire() if CREDENTIALS else None
+        if credential is None:
+            return JSONResponse(status_code=400, content={"error": "缺少 api_id / api_hash"})
+        # 检测只借用凭据，不计入占用
+        CREDENTIALS.release(credential[0])
+        api_id, api_hash = credential
+    try:
+        int(api_id)
+    except (TypeError, ValueError):
+        return JSONResponse(status_code=400, content={"error": "api_id 必须为数字"})
+    try:
+        concurrency = min(max(int(payload.get('concurrency', SESSION_CHECK_CONCURRENCY)), 1), 100)
+    except (TypeError, ValueError):
+        return JSONResponse(status_code=400, content={"error": "concurrency 必须为数字"})
+    try:
+        proxy = build_proxy(payload)
+    except (KeyError, TypeError, ValueError):
+        return JSONResponse(status_code=400, content={"error": "代理配置错误"})
+    entries = await run_blocking(list_session_files, payload.get('filenames'))
+
+    async def stream():
+        started = time.perf_counter()
+        summary = {"alive": 0, "revoked": 0, "flood_limited": 0, "error": 0}
+        yield json.dumps({"type": "start", "total": len(entries)}) + "\n"
+        async for result in check_sessions(entries, api_id, api_hash, proxy, concurrency):
+            summary[result["status"]] += 1
+            yield json.dumps(result, ensure_ascii=False) + "\n"
+        yield json.dumps({"type": "summary", "total": len(entries), **summary,
+                          "elapsed": round(time.perf_counter() - started, 2)}) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+# --------------------------
+# 多进程工作进程
+# --------------------------
+def new_flow_id(nbytes):
+    """生成流程/批次 ID；工作进程中带上 "编号." 前缀，前端据此把后续请求路由回同一进程"""
+    token = secrets.token_urlsafe(nbytes)
+    return f"{WORKER_INDEX}.{token}" if WORKER_INDEX is not None else token
+
+class WorkerRouter:
+    """前端进程: 启动 N 个 uvicorn 工作进程，登录流程在工作进程内运行，前端按 ID 前缀粘滞转发"""
+
+    # 流程与批次状态保存在工作进程内存中，这些路径需要转发
+    ROUTED_PREFIXES = ("/api/flows", "/api/batches")
+    # 运行状态只存在于工作进程中的统计接口，由前端汇总各进程的结果
+    AGGREGATED_PATHS = ("/metrics", "/api/admission", "/api/reaper", "/api/flood-waits", "/api/credentials",
+                        "/api/auth-key-pool", "/api/proxies", "/api/dc-cache")
+    # 不能原样转发的逐跳头
+    HOP_HEADERS = {"host", "connection", "keep-alive", "transfer-encoding", "upgrade", "content-length"}
+
+    def __init__(self, count, base_port):
+        self.count = count
+        self.base_port = base_port
+        self.processes = []
+        self.restarts = 0
+        self._next = 0
+        self._http = None
+        self._supervisor = None
+
+    def _spawn(self, index):
+        env = dict(os.environ, TG_WORKER_INDEX=str(index), TG_WORKERS="0")
+        return subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1",
+             "--port", str(self.base_port + index), "--proxy-headers"],
+            env=env, cwd=os.path.dirname(os.path.abspath(__file__)))
+
+    def start(self):
+        self.processes = [self._spawn(index) for index in range(self.count)]
+        self._http = httpx.AsyncClient(timeout=None)
+        self._supervisor = asyncio.create_task(self.supervise())
+        logger.info(f"已启动 {self.count} 个工作进程 (端口 {self.base_port}-{self.base_port + self.count - 1})")
+
+    async def supervise(self, interval=2):
+        """工作进程意外退出时重新拉起；排空重启期间工作进程会自行退出，不再拉起"""
+        while True:
+            await asyncio.sleep(interval)
+            if DRAINER.draining:
+                continue
+            for index, process in enumerate(self.processes):
+                code = process.poll()
+                if code is not None:
+                    self.restarts += 1
+                    logger.warning(f"工作进程 {index} 已退出 (退出码 {code})，正在重新启动")
+                    self.processes[index] = self._spawn(index)
+
+    def alive(self, index):
+        return self.processes[index].poll() is None
+
+    async def stop(self):
+        if self._supervisor:
+            self._supervisor.cancel()
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            await run_blocking(process.wait)
+        if self._http:
+            await self._http.aclose()
+
+    def url(self, index, scheme="http"):
+        return f"{scheme}://127.0.0.1:{self.base_port + index}"
+
+    def pick(self):
+        """新流程轮询分配到存活的工作进程；全部不可用时照常分配，由转发返回 503"""
+        for _ in range(self.count):
+            index = self._next
+            self._next = (self._next + 1) % self.count
+            if self.alive(index):
+                return index
+        return index
+
+    def owner(self, flow_id):
+        """从 ID 前缀解析所属工作进程，无法识别时返回 None"""
+        prefix, sep, _ = (flow_id or "").partition(".")
+        if sep and prefix.isdigit() and int(prefix) < self.count:
+            return int(prefix)
+        return None
+
+    def route(self, path):
+        """返回请求应转发到的工作进程编号；不需要转发时返回 None"""
+        for prefix in self.ROUTED_PREFIXES:
+            if path == prefix:
+                return self.pick()
+            if path.startswith(prefix + "/"):
+                owner = self.owner(path[len(prefix) + 1:].split("/", 1)[0])
+                return owner if owner is not None else -1
+        return None
+
+    async def forward(self, request, index):
+        """转发 HTTP 请求并流式返回响应 (SSE 与长轮询同样适用)"""
+        headers = [(k, v) for k, v in request.headers.items() if k.lower() not in self.HOP_HEADERS]
+        if request.client:
+            headers.append(("x-forwarded-for", request.client.host))
+        upstream = self._http.build_request(
+            request.method, self.url(index) + request.url.path, params=request.url.query,
+            headers=headers, content=request.stream())
+        try:
+            response = await self._http.send(upstream, stream=True)
+        except httpx.TransportError:
+            return JSONResponse(status_code=503, content={"error": f"工作进程 {index} 暂不可用"})
+        return StreamingResponse(
+            response.aiter_raw(), status_code=response.status_code,
+            headers={k: v for k, v in response.headers.items() if k.lower() not in self.HOP_HEADERS},
+            background=BackgroundTask(response.aclose))
+
+    async def broadcast(self, method, path, params=None):
+        """向所有工作进程发送同一请求，忽略已退出的进程"""
+        for index in range(self.count):
+            try:
+                await self._http.request(method, self.url(index) + path, params=params, timeout=5)
+            except httpx.HTTPError:
+                pass
+
+    async def collect(self, path, params=None, text=False):
+        """汇总各工作进程的 JSON (或文本) 响应，不可达的记为 None"""
+        results = {}
+        for index in range(self.count):
+            try:
+                response = await self._http.get(self.url(index) + path, params=params, timeout=5)
+                results[index] = response.text if text else response.json()
+            except (httpx.HTTPError, ValueError):
+                results[index] = None
+        return results
+
+    async def aggregate(self, request):
+        """统计接口: JSON 按工作进程编号分组返回；/metrics 合并为一份并以 worker 标签区分来源"""
+        if request.url.path != "/metrics":
+            return JSONResponse(content={
+                "workers": await self.collect(request.url.path, request.url.query)})
+        texts = {"frontend": render_metrics()}
+        for index, text in (await self.collect("/metrics", text=True)).items():
+            if text is not None:
+                texts[str(index)] = text
+        return PlainTextResponse(merge_metrics(texts), media_type="text/plain; version=0.0.4")
+
+    async def relay(self, websocket: WebSocket):
+        """把浏览器的 WebSocket 与工作进程的 /ws 双向桥接"""
+        await websocket.accept()
+        first = await websocket.receive_text()
+        data = json.loads(first)
+        index = self.owner(data.get('token')) if data.get('type') == 'resume' else self.pick()
+        if index is None:
+            await websocket.send_json({"type": "resume_failed"})
+            return
+        headers = {"X-Forwarded-For": websocket.client.host} if websocket.client else {}
+        async with websockets.connect(self.url(index, "ws") + "/ws", additional_headers=headers,
+                                      max_size=None) as upstream:
+            await upstream.send(first)
+
+            async def downstream():
+                async for message in upstream:
+                    if isinstance(message, bytes):
+                        await websocket.send_bytes(message)
+                    else:
+                        await websocket.send_text(message)
+
+            async def upstream_pump():
+                while True:
+                    message = await websocket.receive()
+                    if message["type"] == "websocket.disconnect":
+                        return
+                    await upstream.send(message["bytes"] if message.get("bytes") is not None else message["text"])
+
+            tasks = [asyncio.create_task(downstream()), asyncio.create_task(upstream_pump())]
+            try:
+                await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                for task in tasks:
+                    task.cancel()
+        await websocket.close()
+
+WORKER_ROUTER = WorkerRouter(WORKERS, WORKER_BASE_PORT) if IS_FRONTEND else None
+
+@app.on_event("startup")
+async def start_workers():
+    if WORKER_ROUTER:
+        WORKER_ROUTER.start()
+
+@app.on_event("shutdown")
+async def stop_workers():
+    if WORKER_ROUTER:
+        await WORKER_ROUTER.stop()
+
+async def route_to_worker(request: Request, call_next):
+    if request.url.path in WORKER_ROUTER.AGGREGATED_PATHS:
+        return await WORKER_ROUTER.aggregate(request)
+    index = WORKER_ROUTER.route(request.url.path)
+    if index == -1:
+        return JSONResponse(status_code=404, content={"error": "Flow not found"})
+    if index is not None:
+        return await WORKER_ROUTER.forward(request, index)
+    return await call_next(request)
+
+# 仅前端进程挂载转发中间件，单进程模式不增加额外开销
+if WORKER_ROUTER:
+    app.middleware("http")(route_to_worker)
 
 # --------------------------
 # WebSocket 逻辑
 # --------------------------
 
+# 登录流程表: flow_id -> SessionManager，断线后的流程在此暂存等待重连
+FLOWS = {}
+
 class SessionManager:
-    def __init__(self, websocket: WebSocket):
+    # 断线重连后需要重新下发的“当前步骤”消息
+    RESUMABLE_TYPES = ("qr_code", "qr_timeout", "input_required")
+    # 一个 log_batch 帧最多合并的日志条数
+    LOG_BATCH_MAX = 50
+
+    def __init__(self, websocket: WebSocket = None, client_ip=None, headless=False):
+        self.flow_id = new_flow_id(16)
         self.websocket = websocket
+        self.client_ip = websocket.client.host if websocket and websocket.client else client_ip
+        # 无界面流程 (REST API) 不走 WebSocket，消息记录到事件历史中供拉取
+        self.headless = headless
         self.client = None
-    
+        self.ticket = None
+        self.task = None
+        self.parked_at = None
+        self.phase = "queued"
+        self.deadline = None
+        self.expired_reason = None
+        self.outcome = None
+        self.connected = False
+        self.qr_mode = "png"
+        self.pacer = None       # 可选的 RequestPacer，用于限制发送验证码的节奏
+        self.config = None
+        self.proxy = None
+        self.credential = None  # 从凭据池分配的 api_id
+        self.proxy_label = None # 从代理池选用的代理
+        self.home_dc = None     # 根据 DC 缓存预测的账号归属 DC
+        self.created_at = time.time()
+        self.filename = None
+        self.error = None
+        self.checkpoint = None  # 等待输入时可在重启后恢复的进度
+        self._inputs = asyncio.Queue()
+        self._outbox = deque()              # 待发往浏览器的消息，断线期间保留，重连后补发
+        self._outbox_changed = asyncio.Event()
+        self._outbox_drained = asyncio.Event()
+        self._queued_logs = 0
+        self._dropped_logs = 0              # 因积压被丢弃、尚未告知前端的日志数
+        self._writer = None                 # 当前连接的写出任务
+        self._pending = None                # 等待用户处理的当前步骤
+        self._seq = 0
+        self._history = deque(maxlen=200)   # 无界面流程的事件历史: (序号, 消息)
+        self._history_changed = asyncio.Event()
+        if websocket is not None:
+            self._writer = asyncio.create_task(self._write_loop(websocket))
+
+    async def send(self, message):
+        """向前端发送消息: 放入发送队列后立即返回，由写出任务合并发送，浏览器接收慢不会拖慢登录流程"""
+        if message["type"] in self.RESUMABLE_TYPES:
+            self._pending = message
+        if self.headless:
+            self._seq += 1
+            self._history.append((self._seq, message))
+            self.notify_events()
+            return
+        self.enqueue(message)
+
+    def enqueue(self, message):
+        if message["type"] == "qr_code":
+            # 尚未发出的旧二维码已经失效，只保留最新的
+            for queued in [m for m in self._outbox if m["type"] == "qr_code"]:
+                self._outbox.remove(queued)
+        elif message["type"] == "log":
+            if self._queued_logs >= WS_LOG_BUFFER:
+                self._drop_oldest_log()
+            self._queued_logs += 1
+        self._outbox.append(message)
+        self._outbox_drained.clear()
+        self._outbox_changed.set()
+
+    def _drop_oldest_log(self):
+        for queued in self._outbox:
+            if queued["type"] == "log":
+                self._outbox.remove(queued)
+                self._queued_logs -= 1
+                self._dropped_logs += 1
+                return
+
+    def _take_frame(self):
+        """取出下一帧的消息: 队首连续的日志合并发送，其余消息逐条发送"""
+        if self._outbox[0]["type"] != "log":
+            return [self._outbox.popleft()]
+        frame = []
+        while self._outbox and self._outbox[0]["type"] == "log" and len(frame) < self.LOG_BATCH_MAX:
+            frame.append(self._outbox.popleft())
+        self._queued_logs -= len(frame)
+        return frame
+
+    async def _write(self, websocket: WebSocket, frame):
+        message = frame[0]
+        if message["type"] == "log" and (len(frame) > 1 or self._dropped_logs):
+            dropped, self._dropped_logs = self._dropped_logs, 0
+            await websocket.send_json({
+                "type": "log_batch",
+                "entries": [{"text": m["text"], "level": m["level"]} for m in frame],
+                "dropped": dropped,
+            })
+            return
+        # 带二进制负载的消息: 先发 JSON 头，再紧跟一个二进制帧
+        payload = message.get("_binary")
+        if payload is None:
+            await websocket.send_json(message)
+        else:
+            await websocket.send_json({k: v for k, v in message.items() if k != "_binary"})
+            await websocket.send_bytes(payload)
+
+    async def _write_loop(self, websocket: WebSocket):
+        """把发送队列写入连接；写入失败时消息放回队首，等待重连后补发"""
+        while True:
+            if not self._outbox:
+                self._outbox_drained.set()
+                self._outbox_changed.clear()
+                await self._outbox_changed.wait()
+                continue
+            frame = self._take_frame()
+            try:
+                await self._write(websocket, frame)
+            except BaseException as e:
+                # "done" 只对当前连接有意义，重连后不再补发
+                frame = [m for m in frame if m["type"] != "done"]
+                self._outbox.extendleft(reversed(frame))
+                self._queued_logs += sum(1 for m in frame if m["type"] == "log")
+                if isinstance(e, Exception):
+                    self.detach(websocket)
+                    return
+                raise
+
+    async def flush(self, timeout=5):
+        """等待发送队列全部写出；连接断开 (写出任务结束) 时立即返回"""
+        writer = self._writer
+        if writer is None or writer.done():
+            return
+        drained = asyncio.ensure_future(self._outbox_drained.wait())
+        await asyncio.wait({drained, writer}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        drained.cancel()
+
+    def attach(self, websocket: WebSocket):
+        if self._writer:
+            self._writer.cancel()
+        self.websocket = websocket
+        self.parked_at = None
+        self._writer = asyncio.create_task(self._write_loop(websocket))
+
+    def detach(self, websocket: WebSocket):
+        """连接断开: 保留 TelegramClient 与流程状态，进入暂存"""
+        if self.websocket is websocket:
+            self.websocket = None
+            self.parked_at = time.time()
+            if self._writer and self._writer is not asyncio.current_task():
+                self._writer.cancel()
+            self._writer = None
+
+    def replay(self):
+        """重连后先告知已恢复，再补发暂存消息，并确保当前步骤一定重新下发"""
+        if self._pending is not None and not any(m is self._pending for m in self._outbox):
+            self.enqueue(self._pending)
+        self._outbox.appendleft({"type": "resumed"})
+        self._outbox_drained.clear()
+        self._outbox_changed.set()
+
+    def notify_events(self):
+        """唤醒所有等待新事件的拉取请求"""
+        self._history_changed.set()
+        self._history_changed = asyncio.Event()
+
+    async def wait_events(self, after=0, timeout=0):
+        """返回序号大于 after 的事件；暂无新事件且流程未结束时最多等待 timeout 秒"""
+        if self._seq <= after and timeout > 0 and not self.task.done():
+            try:
+                await asyncio.wait_for(self._history_changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return [dict(message, seq=seq) for seq, message in self._history if seq > after]
+
+    def status(self):
+        return {
+            "flow_id": self.flow_id,
+            "phase": self.phase,
+            "done": self.task.done(),
+            "outcome": self.outcome,
+            "error": self.error,
+            "filename": self.filename,
+            "pending": self._pending,
+            "last_seq": self._seq,
+        }
+
+    def enter_phase(self, phase):
+        """切换阶段并按配置设置截止时间，无配置的阶段不限时"""
+        self.phase = phase
+        limit = PHASE_DEADLINES.get(phase)
+        self.deadline = time.time() + limit if limit else None
+
+    def expire(self, reason):
+        """由回收器调用: 结束流程并断开 TelegramClient"""
+        self.expired_reason = reason
+        if self.task and not self.task.done():
+            self.task.cancel()
+
+    def submit_input(self, data):
+        self._pending = None
+        self._inputs.put_nowait(data)
+
+    async def pump(self, websocket: WebSocket):
+        """读取前端消息直到连接断开或流程结束"""
+        while True:
+            receive = asyncio.ensure_future(websocket.receive_json())
+            await asyncio.wait({receive, self.task}, return_when=asyncio.FIRST_COMPLETED)
+            if not receive.done():
+                receive.cancel()
+                FLOWS.pop(self.flow_id, None)
+                # 前端收到结果后可能已先行关闭连接，此时不再发送和关闭
+                if self.websocket is websocket:
+                    await self.send({"type": "done"})
+                    await self.flush()
+                if self.websocket is websocket:
+                    try:
+                        await websocket.close()
+                    except RuntimeError:
+                        pass
+                return
+            data = receive.result()
+            if data.get('type') == 'input_response':
+                self.submit_input(data.get('data'))
+            elif data.get('type') == 'cancel':
+                self.task.cancel()
+
     async def log(self, text, level="info"):
-        await self.websocket.send_json({"type": "log", "text": text, "level": level})
+        await self.send({"type": "log", "text": text, "level": level})
 
-    async def send_qr(self, url):
-        qr = qrcode.QRCode(box_size=10, border=2)
-        qr.add_data(url)
-        qr.make(fit=True)
-        img = qr.make_image(fill_color="black", back_color="white")
-        
-        buf = io.BytesIO()
-        img.save(buf, format='PNG')
-        img_str = base64.b64encode(buf.getvalue()).decode('utf-8')
-        
-        await self.websocket.send_json({"type": "qr_code", "data": img_str})
+    def negotiate_qr_mode(self, accepted):
+        """从前端声明支持的方式中选出服务端允许的第一个，都不支持时回退到 png"""
+        for mode in accepted or ():
+            # 二进制帧只能通过 WebSocket 下发
+            if mode in QR_MODES and not (self.headless and mode == "binary"):
+                return mode
+        return "png"
 
-    async def request_input(self, prompt, field_type="text"):
-        await self.websocket.send_json({"type": "input_required", "prompt": prompt, "field_type": field_type})
-        data = await self.websocket.receive_json()
-        if data.get('type') == 'input_response':
-            return data.get('data')
-        return None
+    async def send_qr(self, url, expires_in=None, refreshed=False):
+        message = {"type": "qr_code", "mode": self.qr_mode, "expires_in": expires_in, "refreshed": refreshed}
+        with LOGIN_PHASE_SECONDS.time("qr_generate"):
+            if self.qr_mode == "url":
+                message["url"] = url
+            elif self.qr_mode == "matrix":
+                message["size"], message["bits"] = await run_blocking(build_qr_matrix, url)
+            elif self.qr_mode == "binary":
+                message["_binary"] = await run_blocking(render_qr_png, url)
+            else:
+                png = await run_blocking(render_qr_png, url)
+                message["data"] = base64.b64encode(png).decode('utf-8')
+
+        await self.send(message)
+
+    async def request_input(self, prompt, field_type="text", phase=None):
+        if phase:
+            self.enter_phase(phase)
+        await self.send({"type": "input_required", "prompt": prompt, "field_type": field_type})
+        data = await self._inputs.get()
+        self.enter_phase("working")
+        return data
 
-    async def run(self, config):
+    async def notify_queue(self, position, eta):
+        await self.log(f"当前排队人数较多: 第 {position} 位，预计等待约 {eta} 秒", "warning")
+
+    def at_checkpoint(self):
+        """正在等待用户输入且进度可保存，重启时无需等待其结束"""
+        return (self.checkpoint is not None and self._pending is not None
+                and self._pending["type"] == "input_required")
+
+    def checkpoint_record(self):
+        return {
+            "flow_id": self.flow_id,
+            "headless": self.headless,
+            "client_ip": self.client_ip,
+            "config": self.config,
+            "checkpoint": self.checkpoint,
+            "session": self.client.session.save() if self.client else None,
+            "last_seq": self._seq,
+        }
+
+    async def run(self, config, resume=None):
+        error = None
         try:
-            proxy = None
-            if config.get('proxy_enabled', False):
-                # 获取协议类型，默认为 socks5
-                p_type = config.get('proxy_type', 'socks5')
-                
-                # 根据不同协议构建代理字典
-                proxy = {
-                    'proxy_type': p_type, # Telethon/Python-socks 接受 'socks5', 'socks4', 'http'
-                    'addr': config['proxy_ip'],
-                    'port': int(config['proxy_port']),
-                }
-                
-                # SOCKS5 通常开启远程 DNS 解析
-                if p_type == 'socks5':
-                    proxy['rdns'] = True
-                
-                await self.log(f"使用代理: {p_type.upper()}://{config['proxy_ip']}:{config['proxy_port']}")
-            else:
-                await self.log("直连模式 (不使用代理)", "info")
+            # 未填写 API 参数时从服务端凭据池分配
+            if not config.get('api_id') or not config.get('api_hash'):
+                credential = CREDENTIALS.acquire() if CREDENTIALS else None
+                if credential is None:
+                    raise Exception("请填写 API ID 和 API Hash" if not CREDENTIALS else "暂无可用的 API 凭据，请稍后再试")
+                self.credential = credential[0]
+                config = dict(config, api_id=credential[0], api_hash=credential[1])
+            self.config = config
 
-            self.client = TelegramClient(
-                StringSession(),
-                int(config['api_id']),
-                config['api_hash'],
-                proxy=proxy,
-                device_model="TG-Session-Web",
-                system_version="Docker/Linux",
-                app_version="1.0.0"
-            )
+            self.qr_mode = self.negotiate_qr_mode(config.get('qr_modes'))
+            self.ticket = await ADMISSION.acquire(config['api_id'], self.client_ip, self.notify_queue,
+                                                  "api_ip" if self.headless else "ip")
+
+            # 未到达需要已有会话的检查点时按新流程处理
+            if resume and resume['checkpoint']['step'] == "phone":
+                resume = None
+            # 手机号登录先取得手机号，以便直接连接账号所在的 DC
+            if config['login_method'] != 'qr' and not config.get('phone') and not resume:
+                self.checkpoint = {"step": "phone"}
+                phone = await self.request_input("请输入手机号 (带区号 +86...):", phase="phone")
+                self.checkpoint = None
+                if not phone:
+                    return
+                config = self.config = dict(config, phone=phone)
+            self.enter_phase("connect")
 
-            await self.client.connect()
+            await self.connect(config, resume and resume.get('session'))
 
             if not await self.client.is_user_authorized():
-                if config['login_method'] == 'qr':
+                if resume:
+                    await self.log("服务已重启，继续之前的登录流程", "info")
+                    await self.continue_login(resume['checkpoint'])
+                elif config['login_method'] == 'qr':
                     await self.handle_qr_login()
                 else:
-                    await self.handle_phone_login()
+                    await self.handle_phone_login(config.get('phone'))
+
+                # 二维码超时等情况下流程结束，不再继续保存
+                if not await self.client.is_user_authorized():
+                    return
             
             string_session = self.client.session.save()
             me = await self.client.get_me()
             
             user_info = f"用户: {me.first_name} (@{me.username}) ID: {me.id}"
             await self.log(f"登录成功! {user_info}", "success")
+
+            dc_id = self.client.session.dc_id
+            DC_CACHE.learn(config.get('phone'), me.id, dc_id)
+            DC_CACHE.record_prediction(self.home_dc, dc_id)
             
-            # 保存文件
+            # 保存文件、元数据侧车文件并登记索引
             timestamp = int(time.time())
             filename = f"session_{me.id}_{timestamp}.txt"
-            file_path = os.path.join(SESSIONS_DIR, filename)
-            
-            with open(file_path, "w", encoding="utf-8") as f:
-                f.write(string_session)
+            metadata = build_account_metadata(me, dc_id, {
+                "api_id": int(config['api_id']),
+                "proxy": proxy_label(self.proxy),
+                "login_method": config['login_method'],
+                "duration": round(time.time() - self.created_at, 2),
+                "created_at": timestamp,
+                "app_version": APP_VERSION,
+            })
+            await run_blocking(CATALOG.save_session, filename, string_session, {
+                "user_id": me.id,
+                "username": me.username,
+                "dc_id": dc_id,
+                "api_id": int(config['api_id']),
+                "created_at": timestamp,
+            }, metadata)
+            self.filename = filename
             
-            await self.websocket.send_json({
+            await self.send({
                 "type": "session_generated", 
                 "session": string_session,
                 "file_path": filename,
                 "filename": filename
             })
+            self.outcome = "success"
+
+            if DC_CACHE.options_stale():
+                try:
+                    await DC_CACHE.refresh_options(self.client)
+                except Exception as e:
+                    logger.warning(f"更新 DC 地址表失败: {e}")
 
+        except asyncio.CancelledError:
+            self.outcome = "timeout" if self.expired_reason else "cancelled"
+            if self.expired_reason:
+                await self.log(f"等待超时 ({self.expired_reason})，流程已结束，请重新开始", "error")
+            raise
         except Exception as e:
+            error = e
+            self.error = str(e)
+            if not self.outcome:
+                self.outcome = "flood_wait" if isinstance(e, (telethon_errors.FloodWaitError, FloodWaitTooLong)) else "error"
             await self.log(f"操作中止或出错: {str(e)}", "error")
         finally:
+            LOGIN_OUTCOMES.inc(self.outcome or "aborted")
             if self.client:
                 await self.client.disconnect()
+            if self.connected:
+                CONNECTED_CLIENTS.dec()
+                if self.proxy_label:
+                    PROXY_POOL.release(self.proxy_label)
+            if self.ticket:
+                ADMISSION.release(self.ticket)
+            if self.credential:
+                CREDENTIALS.release(self.credential, error)
+
+    async def connect(self, config, saved_session=None):
+        """创建并连接 TelegramClient；使用代理池时连接失败会自动切换到下一个健康代理。
+        saved_session 为重启前保存的会话，恢复流程时沿用原 auth key"""
+        use_pool = bool(config.get('proxy_enabled')) and config.get('proxy_type') == 'pool'
+        if not saved_session:
+            self.home_dc = DC_CACHE.predict(config.get('phone'))
+            if self.home_dc:
+                await self.log(f"根据历史记录直接连接 DC{self.home_dc}", "info")
+        tried = set()
+        while True:
+            if use_pool:
+                self.proxy_label, self.proxy = PROXY_POOL.select(pin=config.get('phone'), exclude=tried)
+                if self.proxy is None:
+                    raise Exception("代理池中没有可用的代理")
+                tried.add(self.proxy_label)
+                await self.log(f"使用代理池: {self.proxy_label}")
+            else:
+                self.proxy = build_proxy(config)
+                if self.proxy:
+                    await self.log(f"使用代理: {proxy_label(self.proxy).upper()}")
+                else:
+                    await self.log("直连模式 (不使用代理)", "info")
+
+            # 优先使用预备池中已完成握手的 auth key，池空时走完整握手
+            pooled_key = saved_session or AUTH_KEY_POOL.acquire(
+                config['api_id'], config['api_hash'], self.proxy, self.home_dc or DEFAULT_DC_ID,
+                keep_warm=use_pool or (self.proxy is None and bool(WARMUP_API_ID and WARMUP_API_HASH)))
+            if pooled_key and not saved_session:
+                await self.log("使用预备 auth key，跳过握手", "info")
+
+            self.client = create_client(
+                telethon_sessions.StringSession(pooled_key) if pooled_key else DC_CACHE.new_session(self.home_dc),
+                config['api_id'],
+                config['api_hash'],
+                self.proxy,
+                # 代理池模式下快速失败，交给故障切换处理
+                **({'connection_retries': 1} if use_pool else {})
+            )
+
+            started = time.perf_counter()
+            try:
+                with LOGIN_PHASE_SECONDS.time("connect"):
+                    await self.client.connect()
+            except Exception as e:
+                if not use_pool:
+                    raise
+                PROXY_POOL.report(self.proxy_label, ok=False)
+                await self.client.disconnect()
+                await self.log(f"代理 {self.proxy_label} 连接失败，尝试切换: {e}", "warning")
+                continue
+            if use_pool:
+                PROXY_POOL.report(self.proxy_label, ok=True, latency=time.perf_counter() - started)
+                PROXY_POOL.acquire(self.proxy_label)
+            break
+
+        self.connected = True
+        CONNECTED_CLIENTS.inc()
+        self.enter_phase("working")
 
     async def handle_qr_login(self):
         try:
-            qr_login = await self.client.qr_login()
+            self.enter_phase("qr")
+            qr_login = await self.call_scheduled(self.client.qr_login)
             await self.log("正在生成二维码...", "info")
-            await self.send_qr(qr_login.url)
-            
-            # 后端 60 秒超时控制
-            try:
-                await qr_login.wait(timeout=60)
-            except asyncio.TimeoutError:
-                await self.websocket.send_json({"type": "qr_timeout"})
-                # raise Exception("二维码已过期") # 移除 Exception 以避免日志报错，由前端处理
-                return # 结束流程
-            except SessionPasswordNeededError:
-                await self.handle_2fa()
+            deadline = time.time() + QR_LOGIN_TIMEOUT
+            scan_started = time.perf_counter()
+            refreshed = False
+
+            while True:
+                expires_in = (qr_login.expires - datetime.now(timezone.utc)).total_seconds()
+                await self.send_qr(qr_login.url, int(expires_in), refreshed)
+
+                # 在旧二维码过期前提前换新，整体超时由后端控制
+                timeout = min(expires_in - QR_REFRESH_MARGIN, deadline - time.time())
+                try:
+                    await qr_login.wait(timeout=max(timeout, 1))
+                    LOGIN_PHASE_SECONDS.observe("qr_scan", time.perf_counter() - scan_started)
+                    return
+                except asyncio.TimeoutError:
+                    if time.time() >= deadline:
+                        self.outcome = "timeout"
+                        await self.send({"type": "qr_timeout"})
+                        # raise Exception("二维码已过期") # 移除 Exception 以避免日志报错，由前端处理
+                        return # 结束流程
+                    # 复用当前连接重新申请 token，无需重建客户端
+                    await self.call_scheduled(qr_login.recreate)
+                    refreshed = True
+                except telethon_errors.SessionPasswordNeededError:
+                    await self.handle_2fa()
+                    return
                 
         except Exception as e:
              raise e
 
-    async def handle_phone_login(self):
-        phone = await self.request_input("请输入手机号 (带区号 +86...):")
+    async def continue_login(self, checkpoint):
+        """从重启前保存的检查点继续登录"""
+        if checkpoint["step"] == "2fa":
+            await self.handle_2fa()
+        else:
+            await self.handle_phone_login(checkpoint.get("phone"), checkpoint.get("phone_code_hash"))
+
+    async def handle_phone_login(self, phone=None, phone_code_hash=None):
+        if not phone:
+            self.checkpoint = {"step": "phone"}
+            phone = await self.request_input("请输入手机号 (带区号 +86...):", phase="phone")
+            self.checkpoint = None
         if not phone: return
-        
-        await self.log(f"正在发送验证码到 {phone} ...")
-        await self.client.send_code_request(phone)
-        
-        code = await self.request_input("请输入收到的验证码:")
+
+        if phone_code_hash is None:
+            await self.log(f"正在发送验证码到 {phone} ...")
+
+            async def send_code():
+                with LOGIN_PHASE_SECONDS.time("send_code"):
+                    return await self.client.send_code_request(phone)
+
+            async def paced_send_code():
+                async with self.pacer.slot():
+                    return await send_code()
+
+            sent = await self.call_scheduled(paced_send_code if self.pacer else send_code, phone)
+            phone_code_hash = sent.phone_code_hash
+            # 发送验证码时已完成可能的 DC 迁移，当前 DC 即为该号码的归属 DC
+            DC_CACHE.learn(phone, dc_id=self.client.session.dc_id)
+
+        self.checkpoint = {"step": "code", "phone": phone, "phone_code_hash": phone_code_hash}
+        code = await self.request_input("请输入收到的验证码:", phase="code")
+        self.checkpoint = None
+
+        async def sign_in():
+            with LOGIN_PHASE_SECONDS.time("sign_in"):
+                await self.client.sign_in(phone, code, phone_code_hash=phone_code_hash)
         
         try:
-            await self.client.sign_in(phone, code)
-        except SessionPasswordNeededError:
+            await self.call_scheduled(sign_in, phone)
+        except telethon_errors.SessionPasswordNeededError:
             await self.handle_2fa()
-        except PhoneCodeInvalidError:
+        except telethon_errors.PhoneCodeInvalidError:
+            self.outcome = "code_invalid"
             await self.log("验证码错误", "error")
             raise Exception("验证码错误")
 
     async def handle_2fa(self):
         await self.log("检测到两步验证密码", "warning")
-        password = await self.request_input("请输入两步验证密码:", "password")
-        await self.client.sign_in(password=password)
+        self.checkpoint = {"step": "2fa"}
+        password = await self.request_input("请输入两步验证密码:", "password", phase="2fa")
+        self.checkpoint = None
+        with LOGIN_PHASE_SECONDS.time("2fa"):
+            await self.client.sign_in(password=password)
+
+    async def call_scheduled(self, func, phone=None):
+        """经 FloodWait 调度器执行请求，需要等待时提示用户预计时间。
+        针对手机号的请求 (send_code / sign_in) 的 FloodWait 只限制该号码；
+        其余请求 (二维码 token 等) 记在 api_id 及所用代理上，直连不设代理维度"""
+        keys = [("api_id", str(self.config['api_id']))]
+        if self.proxy:
+            keys.append(("proxy", self.proxy_label or proxy_label(self.proxy)))
+        scope = list(keys)
+        if phone:
+            scope = [("phone", phone)]
+            keys.insert(0, scope[0])
+        phase = self.phase
+
+        async def notify(seconds):
+            self.enter_phase("flood_wait")
+            await self.log(f"触发 Telegram 频率限制，约 {seconds} 秒后自动重试", "warning")
+
+        # 由调度器统一处理 FloodWait，避免 Telethon 在内部静默休眠
+        threshold = self.client.flood_sleep_threshold
+        self.client.flood_sleep_threshold = 0
+        try:
+            return await FLOOD_WAITS.call(keys, func, notify, scope)
+        finally:
+            self.client.flood_sleep_threshold = threshold
+            # 等待过 FloodWait 后回到原阶段并重新计时
+            if self.phase == "flood_wait":
+                self.enter_phase(phase)
+
+# 回收统计: 原因 -> 累计回收数
+REAPER_STATS = {"runs": 0, "reclaimed": 0, "by_reason": {}, "batches_evicted": 0}
+
+def reap_flows():
+    """回收超过阶段截止时间或暂存时限的流程，返回本次回收数"""
+    now = time.time()
+    reclaimed = 0
+    for flow_id, manager in list(FLOWS.items()):
+        running = manager.task is not None and not manager.task.done()
+        if manager.parked_at and now - manager.parked_at > FLOW_PARK_TTL:
+            reason = "parked"
+        elif running and manager.deadline and now > manager.deadline:
+            reason = manager.phase
+        else:
+            continue
+        FLOWS.pop(flow_id, None)
+        manager.expire(reason)
+        if running:
+            reclaimed += 1
+            REAPER_STATS["by_reason"][reason] = REAPER_STATS["by_reason"].get(reason, 0) + 1
+    # 批次在所有行结束后再保留 FLOW_PARK_TTL 秒，随后连同其流程一起释放
+    for batch_id, batch in list(BATCHES.items()):
+        if not all(manager.task.done() for _, _, manager in batch.rows):
+            continue
+        batch.finished_at = batch.finished_at or now
+        if now - batch.finished_at > FLOW_PARK_TTL:
+            del BATCHES[batch_id]
+            REAPER_STATS["batches_evicted"] += 1
+    REAPER_STATS["runs"] += 1
+    REAPER_STATS["reclaimed"] += reclaimed
+    return reclaimed
+
+async def run_flow_reaper():
+    while True:
+        await asyncio.sleep(REAPER_INTERVAL)
+        reclaimed = reap_flows()
+        if reclaimed:
+            logger.info(f"回收了 {reclaimed} 个超时的登录流程")
+
+@app.on_event("startup")
+async def start_flow_reaper():
+    app.state.flow_reaper_task = asyncio.create_task(run_flow_reaper())
+
+@app.get("/api/reaper")
+def reaper_stats():
+    """超时回收统计与当前各阶段的流程数"""
+    phases = {}
+    for manager in FLOWS.values():
+        phases[manager.phase] = phases.get(manager.phase, 0) + 1
+    return JSONResponse(content={**REAPER_STATS, "flows": len(FLOWS), "batches": len(BATCHES), "phases": phases})
+
+# --------------------------
+# 排空与重启
+# --------------------------
+class Drainer:
+    """优雅重启: 停止接收新流程，等待进行中的流程结束或到达可恢复的检查点，保存进度后退出进程"""
+
+    def __init__(self, state_path):
+        self.state_path = state_path
+        self.state = "running"      # running -> draining -> exiting
+        self.started_at = None
+        self.deadline = None
+        self.persisted = 0
+        self.interrupted = 0
+
+    @property
+    def draining(self):
+        return self.state != "running"
+
+    def start(self, timeout):
+        if self.draining:
+            return
+        self.state = "draining"
+        self.started_at = time.time()
+        self.deadline = self.started_at + timeout
+        logger.info(f"开始排空登录流程，最长等待 {timeout} 秒后重启")
+        app.state.drain_task = asyncio.create_task(self.run())
+
+    @staticmethod
+    def active_flows():
+        return [m for m in FLOWS.values() if m.task and not m.task.done()]
+
+    async def run(self):
+        while time.time() < self.deadline:
+            if WORKER_ROUTER:
+                # 前端进程等待所有工作进程自行排空退出
+                if all(p.poll() is not None for p in WORKER_ROUTER.processes):
+                    break
+            elif all(m.at_checkpoint() for m in self.active_flows()):
+                break
+            await asyncio.sleep(1)
+        await self.persist_flows()
+        # os._exit 不会执行 shutdown 钩子，只在停机时落盘的状态需要在这里保存
+        await save_dc_cache()
+        self.state = "exiting"
+        # 留出时间把最后的提示送达前端
+        await asyncio.sleep(1)
+        os._exit(0)
+
+    async def persist_flows(self, notify=True):
+        """保存处于检查点的流程，其余流程直接中断"""
+        records = []
+        for manager in self.active_flows():
+            if manager.at_checkpoint():
+                records.append(manager.checkpoint_record())
+                if notify:
+                    await manager.log("服务正在重启，当前进度已保存，重连后可继续", "warning")
+            else:
+                self.interrupted += 1
+                if notify:
+                    await manager.log("服务正在重启，登录流程已中断，请稍后重新开始", "error")
+        if records:
+            await run_blocking(self.save, records)
+        self.persisted = len(records)
+
+    def save(self, records):
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(records, f, ensure_ascii=False)
+        os.replace(tmp_path, self.state_path)
+
+    def load(self):
+        """读取并删除上次退出前保存的流程，文件只使用一次"""
+        try:
+            with open(self.state_path, encoding="utf-8") as f:
+                records = json.load(f)
+        except FileNotFoundError:
+            return []
+        except ValueError:
+            records = []
+        os.remove(self.state_path)
+        return records
+
+    def status(self):
+        active = self.active_flows()
+        return {
+            "state": self.state,
+            "started_at": self.started_at,
+            "deadline": self.deadline,
+            "active_flows": len(active),
+            "at_checkpoint": sum(1 for m in active if m.at_checkpoint()),
+            "persisted": self.persisted,
+            "interrupted": self.interrupted,
+        }
+
+# 每个工作进程各自保存一份
+DRAINER = Drainer(os.path.join(
+    SESSIONS_DIR, "drain_state.json" if WORKER_INDEX is None else f"drain_state_{WORKER_INDEX}.json"))
+
+@app.on_event("startup")
+async def restore_drained_flows():
+    """恢复上次重启前保存的流程，沿用原流程 ID 以便前端断线重连"""
+    if IS_FRONTEND:
+        return
+    records = await run_blocking(DRAINER.load)
+    for record in records:
+        if record["headless"]:
+            start_headless_flow(record["config"], record["client_ip"], resume=record)
+            continue
+        manager = SessionManager(client_ip=record["client_ip"])
+        manager.flow_id = record["flow_id"]
+        # 等待浏览器重连，超过暂存时限由回收器清理
+        manager.parked_at = time.time()
+        FLOWS[manager.flow_id] = manager
+        manager.task = asyncio.create_task(manager.run(record["config"], resume=record))
+    if records:
+        logger.info(f"已恢复 {len(records)} 个重启前保存的登录流程")
+
+@app.on_event("shutdown")
+async def persist_flows_on_shutdown():
+    # 收到 SIGTERM 等未经排空的停机时也尽量保存可恢复的流程
+    if not DRAINER.draining and not IS_FRONTEND:
+        await DRAINER.persist_flows(notify=False)
+
+@app.get("/api/drain")
+async def drain_status():
+    """排空进度，供滚动部署轮询；前端进程同时汇总各工作进程的状态"""
+    content = DRAINER.status()
+    if WORKER_ROUTER:
+        content["workers"] = await WORKER_ROUTER.collect("/api/drain")
+    return JSONResponse(content=content)
+
+def draining_response():
+    return JSONResponse(status_code=503, headers={"Retry-After": "30"},
+                        content={"error": "服务正在重启，暂不接受新的登录流程"})
+
+# --------------------------
+# REST / SSE 无界面登录接口
+# --------------------------
+def _get_headless_flow(flow_id):
+    manager = FLOWS.get(flow_id)
+    if manager is None or not manager.headless:
+        return None
+    return manager
+
+def _flow_not_found():
+    return JSONResponse(status_code=404, content={"error": "Flow not found"})
+
+def start_headless_flow(config, client_ip=None, pacer=None, resume=None):
+    manager = SessionManager(client_ip=client_ip, headless=True)
+    manager.pacer = pacer
+    if resume:
+        # 沿用原流程 ID 与事件序号，客户端的 after 游标仍然有效
+        manager.flow_id = resume["flow_id"]
+        manager._seq = resume["last_seq"]
+    FLOWS[manager.flow_id] = manager
+    manager.task = asyncio.create_task(manager.run(config, resume))
+
+    def finished(_task):
+        # 结束后保留一段时间以便取回结果，超时由回收器清理
+        manager.parked_at = time.time()
+        manager.notify_events()
+    manager.task.add_done_callback(finished)
+    return manager
+
+@app.post("/api/flows")
+async def create_flow(config: dict, request: Request):
+    """创建登录流程，参数与 WebSocket init 消息的 data 相同 (可额外提供 phone 跳过手机号询问)"""
+    if DRAINER.draining:
+        return draining_response()
+    manager = start_headless_flow(config, request.client.host if request.client else None)
+    return JSONResponse(status_code=201, content={"flow_id": manager.flow_id, "ttl": FLOW_PARK_TTL})
+
+@app.get("/api/flows/{flow_id}")
+async def get_flow(flow_id: str, after: int = 0, wait: float = 0):
+    """查询流程状态与 after 之后的事件；wait > 0 时长轮询等待新事件"""
+    manager = _get_headless_flow(flow_id)
+    if manager is None:
+        return _flow_not_found()
+    events = await manager.wait_events(after, min(max(wait, 0), 60))
+    return JSONResponse(content={**manager.status(), "events": events})
+
+@app.post("/api/flows/{flow_id}/input")
+async def submit_flow_input(flow_id: str, payload: dict):
+    """提交手机号 / 验证码 / 两步验证密码: {"data": "..."}"""
+    manager = _get_headless_flow(flow_id)
+    if manager is None:
+        return _flow_not_found()
+    if manager.task.done() or manager._pending is None or manager._pending["type"] != "input_required":
+        return JSONResponse(status_code=409, content={"error": "Flow is not waiting for input"})
+    manager.submit_input(payload.get('data'))
+    return JSONResponse(content={"status": "accepted"})
+
+@app.delete("/api/flows/{flow_id}")
+async def cancel_flow(flow_id: str):
+    manager = _get_headless_flow(flow_id)
+    if manager is None:
+        return _flow_not_found()
+    manager.task.cancel()
+    return JSONResponse(content={"status": "cancelled"})
+
+@app.get("/api/flows/{flow_id}/events")
+async def stream_flow_events(flow_id: str, request: Request):
+    """以 Server-Sent Events 推送流程事件，支持 Last-Event-ID 断点续传"""
+    manager = _get_headless_flow(flow_id)
+    if manager is None:
+        return _flow_not_found()
+    after = int(request.headers.get("last-event-id") or 0)
+
+    async def stream():
+        nonlocal after
+        while True:
+            events = await manager.wait_events(after, timeout=15)
+            for event in events:
+                after = event["seq"]
+                yield f"id: {after}\nevent: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+            if not events:
+                if manager.task.done():
+                    yield f"event: end\ndata: {json.dumps(manager.status(), ensure_ascii=False)}\n\n"
+                    return
+                yield ": keepalive\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# --------------------------
+# 批量手机号导入
+# --------------------------
+class RequestPacer:
+    """限制并发，并在相邻两次请求之间插入随机间隔，避免集中触发风控"""
+
+    def __init__(self, concurrency, min_gap, max_gap):
+        self.min_gap = min_gap
+        self.max_gap = max_gap
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._lock = asyncio.Lock()
+        self._next_at = 0.0
+
+    @asynccontextmanager
+    async def slot(self):
+        async with self._semaphore:
+            async with self._lock:
+                delay = self._next_at - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                self._next_at = time.monotonic() + random.uniform(self.min_gap, self.max_gap)
+            yield
+
+def parse_proxy_url(value):
+    """把 socks5://host:port 形式的代理 (或 pool 表示使用代理池) 转换为登录配置中的代理字段"""
+    if not value:
+        return {"proxy_enabled": False}
+    if value == "pool":
+        return {"proxy_enabled": True, "proxy_type": "pool"}
+    scheme, _, address = value.rpartition("://")
+    host, _, port = address.rpartition(":")
+    return {"proxy_enabled": True, "proxy_type": scheme or "socks5", "proxy_ip": host, "proxy_port": port}
+
+def parse_batch_rows(content, filename):
+    """解析 CSV (需包含 phone 列) 或 JSONL，返回行字典列表"""
+    text = content.decode("utf-8-sig")
+    if filename.lower().endswith((".jsonl", ".json")) or text.lstrip().startswith("{"):
+        rows = []
+        for number, line in enumerate(text.splitlines(), 1):
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            if not isinstance(row, dict):
+                raise ValueError(f"第 {number} 行不是 JSON 对象")
+            rows.append(row)
+    else:
+        rows = list(csv.DictReader(io.StringIO(text)))
+    return [row for row in rows if str(row.get("phone") or "").strip()]
+
+class ImportBatch:
+    def __init__(self, rows, defaults, pacer):
+        self.batch_id = new_flow_id(8)
+        self.created_at = time.time()
+        self.finished_at = None # 所有行结束的时间，之后保留 FLOW_PARK_TTL 秒供查询
+        self.rows = []      # [(行号, 手机号, SessionManager)]
+        for index, row in enumerate(rows, 1):
+            phone = str(row.get("phone", "")).strip()
+            config = {
+                "api_id": str(row.get("api_id") or defaults["api_id"]),
+                "api_hash": row.get("api_hash") or defaults["api_hash"],
+                "login_method": "phone",
+                "phone": phone,
+                **parse_proxy_url(row.get("proxy") or defaults["proxy"]),
+            }
+            self.rows.append((index, phone, start_headless_flow(config, pacer=pacer)))
+
+    @staticmethod
+    def row_status(manager):
+        if manager.task.done():
+            return "done" if manager.outcome == "success" else "failed"
+        if manager._pending and manager._pending["type"] == "input_required":
+            return {"code": "waiting_code", "2fa": "waiting_password"}.get(manager.phase, "waiting_input")
+        if manager.phase in ("code", "2fa"):
+            return "signing_in"   # 已提交输入，等待 Telegram 校验
+        return manager.phase
+
+    def row_info(self, index, phone, manager):
+        return {
+            "row": index,
+            "phone": phone,
+            "flow_id": manager.flow_id,
+            "status": self.row_status(manager),
+            "filename": manager.filename,
+            "error": manager.error,
+        }
+
+    def summary(self):
+        counts = {}
+        for _, _, manager in self.rows:
+            status = self.row_status(manager)
+            counts[status] = counts.get(status, 0) + 1
+        return {"batch_id": self.batch_id, "total": len(self.rows), "status": counts}
+
+BATCHES = {}
+
+def _get_batch_row(batch_id, row):
+    batch = BATCHES.get(batch_id)
+    if batch is None or not 1 <= row <= len(batch.rows):
+        return None, None
+    return batch, batch.rows[row - 1]
+
+@app.post("/api/batches")
+async def create_batch(file: UploadFile = File(...), api_id: str = Form(""), api_hash: str = Form(""),
+                       proxy: str = Form(""), concurrency: int = Form(BATCH_SEND_CONCURRENCY),
+                       min_gap: float = Form(BATCH_MIN_GAP), max_gap: float = Form(BATCH_MAX_GAP)):
+    """上传 CSV / JSONL 批量发起手机号登录
+
+    每行包含 phone，可选 api_id / api_hash / proxy (socks5://host:port)，缺省使用表单中的值。
+    验证码请求以有限并发、随机间隔依次发出，验证码通过 /api/batches/{id}/rows/{row}/input 提交。
+    """
+    if DRAINER.draining:
+        return draining_response()
+    try:
+        rows = parse_batch_rows(await file.read(), file.filename or "")
+    except (ValueError, UnicodeDecodeError) as e:
+        return JSONResponse(status_code=400, content={"error": f"无法解析文件: {e}"})
+    if not rows:
+        return JSONResponse(status_code=400, content={"error": "文件中没有手机号"})
+    if not CREDENTIALS and any(not (row.get("api_id") or api_id) or not (row.get("api_hash") or api_hash) for row in rows):
+        return JSONResponse(status_code=400, content={"error": "缺少 api_id / api_hash"})
+
+    pacer = RequestPacer(max(concurrency, 1), max(min_gap, 0), max(max_gap, min_gap, 0))
+    batch = ImportBatch(rows, {"api_id": api_id, "api_hash": api_hash, "proxy": proxy}, pacer)
+    BATCHES[batch.batch_id] = batch
+    return JSONResponse(status_code=201, content=batch.summary())
+
+@app.get("/api/batches/{batch_id}")
+def get_batch(batch_id: str, status: str = None):
+    """批次进度: 各状态计数及每行详情，可按 status 过滤"""
+    batch = BATCHES.get(batch_id)
+    if batch is None:
+        return JSONResponse(status_code=404, content={"error": "Batch not found"})
+    rows = [batch.row_info(*row) for row in batch.rows]
+    if status:
+        rows = [row for row in rows if row["status"] == status]
+    return JSONResponse(content={**batch.summary(), "rows": rows})
+
+@app.get("/api/batches/{batch_id}/rows/{row}")
+def get_batch_row(batch_id: str, row: int):
+    batch, entry = _get_batch_row(batch_id, row)
+    if batch is None:
+        return JSONResponse(status_code=404, content={"error": "Row not found"})
+    return JSONResponse(content=batch.row_info(*entry))
+
+@app.post("/api/batches/{batch_id}/rows/{row}/input")
+async def submit_batch_input(batch_id: str, row: int, payload: dict):
+    """提交某一行的验证码或两步验证密码: {"data": "..."}"""
+    batch, entry = _get_batch_row(batch_id, row)
+    if batch is None:
+        return JSONResponse(status_code=404, content={"error": "Row not found"})
+    manager = entry[2]
+    if manager.task.done() or manager._pending is None or manager._pending["type"] != "input_required":
+        return JSONResponse(status_code=409, content={"error": "Row is not waiting for input"})
+    manager.submit_input(payload.get('data'))
+    return JSONResponse(content=batch.row_info(*entry))
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
+    if WORKER_ROUTER:
+        try:
+            await WORKER_ROUTER.relay(websocket)
+        except (WebSocketDisconnect, OSError, websockets.ConnectionClosed):
+            pass
+        return
     await websocket.accept()
-    manager = SessionManager(websocket)
+    ACTIVE_WEBSOCKETS.inc()
+    manager = None
     try:
         data = await websocket.receive_json()
         if data.get('type') == 'init':
+            if DRAINER.draining:
+                await websocket.send_json({"type": "log", "text": "服务正在重启，请稍后再试", "level": "error"})
+                return
             config = data.get('data')
-            await manager.run(config)
+            manager = SessionManager(websocket)
+            FLOWS[manager.flow_id] = manager
+            await manager.send({"type": "flow", "token": manager.flow_id, "ttl": FLOW_PARK_TTL})
+            manager.task = asyncio.create_task(manager.run(config))
+        elif data.get('type') == 'resume':
+            manager = FLOWS.get(data.get('token'))
+            if manager is None:
+                await websocket.send_json({"type": "resume_failed"})
+                return
+            manager.attach(websocket)
+            manager.replay()
+        else:
+            return
+        await manager.pump(websocket)
     except WebSocketDisconnect:
         pass
     except Exception as e:
-        print(f"WS Error: {e}")
\ No newline at end of file
+        print(f"WS Error: {e}")
+    finally:
+        ACTIVE_WEBSOCKETS.dec()
+        if manager:
+            manager.detach(websocket)
+            # 流程已结束且消息均已送达，无需再暂存
+            if manager.task and manager.task.done() and not manager._outbox:
+                FLOWS.pop(manager.flow_id, None)
+
+# --------------------------
+# 启动完成与后台预热
+# --------------------------
+def warm_up():
+    """导入登录流程用到的模块 (含二维码渲染所需的 PIL)，构建并压缩静态资源 (在线程池中执行)"""
+    for module in (telethon, telethon_sessions, telethon_errors, qrcode, qrcode_pil):
+        module.load()
+    STATIC.build(STATIC_DIR, render_index_page)
+    started = time.perf_counter()
+    STATIC.compress_all()
+    STARTUP.record("static_compress", time.perf_counter() - started)
+
+async def warm_up_in_background():
+    started = time.perf_counter()
+    await run_blocking(warm_up)
+    STARTUP.record("warm_up", time.perf_counter() - started)
+    report = STARTUP.report()
+    logger.info(f"启动完成: {report['ready_seconds']} 秒开始监听，各阶段耗时 {report['phases']}，"
+                f"后台预热 {report['background']}")
+
+@app.on_event("startup")
+async def finish_startup():
+    # 最后一个启动钩子，返回后 uvicorn 即开始监听端口；耗时的预热放到后台进行
+    STARTUP.ready()
+    app.state.warm_up_task = asyncio.create_task(warm_up_in_background())
+
+@app.get("/api/startup")
+def startup_report():
+    """启动各阶段耗时: 模块导入、模块初始化、启动钩子，以及后台预热和按需导入"""
+    return JSONResponse(content=STARTUP.report())
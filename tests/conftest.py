@@ -0,0 +1,47 @@
+"""
+测试公共配置: 在导入 main 之前把数据目录指向临时目录并关闭后台预热与准入限制，
+用 bench.FakeTelegramClient 替换真实客户端，整个测试过程不产生任何网络请求。
+"""
+import os
+import sys
+import tempfile
+
+WORKDIR = tempfile.mkdtemp(prefix="tg-test-")
+os.environ.update({
+    "TG_SESSIONS_DIR": WORKDIR,
+    "TG_CATALOG_PATH": os.path.join(WORKDIR, "catalog.db"),
+    "TG_DC_CACHE_PATH": os.path.join(WORKDIR, "dc_cache.json"),
+    "TG_AUTH_KEY_POOL_SIZE": "0",
+    "TG_MAX_ACTIVE_FLOWS": "0",
+    "TG_MAX_FLOWS_PER_API_ID": "0",
+    "TG_MAX_FLOWS_PER_IP": "0",
+    "TG_MAX_API_FLOWS_PER_IP": "0",
+    "TG_API_CREDENTIALS": "",
+    "TG_PROXY_POOL": "",
+    "TG_WORKERS": "0",
+})
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from fastapi.testclient import TestClient
+
+import bench
+import main
+
+
+@pytest.fixture(autouse=True)
+def fake_telegram(monkeypatch):
+    """模拟后端: 极短的网络延迟，不触发 FloodWait 与两步验证"""
+    monkeypatch.setattr(bench.FakeTelegramClient, "profile", bench.FakeProfile(
+        connect_latency=0.001, rpc_latency=0.001, scan_delay=0.05,
+        flood_rate=0, flood_seconds=0, password_rate=0))
+    monkeypatch.setattr(main, "create_client", bench.FakeTelegramClient)
+    yield
+    main.FLOWS.clear()
+    main.BATCHES.clear()
+
+
+@pytest.fixture
+def client():
+    with TestClient(main.app) as test_client:
+        yield test_client
@@ -0,0 +1,83 @@
+"""FloodWait 调度: 限制记在错误所属的维度上"""
+import asyncio
+
+import pytest
+
+import bench
+import main
+
+
+class FloodWait(main.telethon_errors.FloodWaitError):
+    def __init__(self, seconds):
+        super().__init__(request=None, capture=seconds)
+
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    scheduler = main.FloodWaitScheduler(max_wait=300)
+    monkeypatch.setattr(main, "FLOOD_WAITS", scheduler)
+    return scheduler
+
+
+def make_manager(proxy=None, proxy_label=None):
+    manager = main.SessionManager()
+    manager.config = {"api_id": "7"}
+    manager.proxy = proxy
+    manager.proxy_label = proxy_label
+    manager.client = bench.FakeTelegramClient(None, 7, "x")
+    return manager
+
+
+def flood_call(seconds=400, phone=None, **kwargs):
+    """在新的流程中执行一次必然触发 FloodWait 的请求，返回 (流程, 最终抛出的异常)"""
+    async def request():
+        raise FloodWait(seconds)
+
+    async def run():
+        manager = make_manager(**kwargs)
+        with pytest.raises(Exception) as raised:
+            await manager.call_scheduled(request, phone=phone)
+        return manager, raised.value
+    return asyncio.run(run())
+
+
+def test_phone_request_flood_is_scoped_to_the_phone(scheduler):
+    _, error = flood_call(phone="+8613800000000")
+    assert isinstance(error, main.FloodWaitTooLong)
+    assert set(scheduler._until) == {("phone", "+8613800000000")}
+    # 同一 api_id 下的其它号码不受影响
+    assert scheduler.remaining([("phone", "+8613800000001"), ("api_id", "7")]) == 0
+
+
+def test_other_requests_are_scoped_to_api_id_and_proxy(scheduler):
+    proxy = {"proxy_type": "socks5", "addr": "10.0.0.1", "port": 1080}
+    flood_call(proxy=proxy)
+    assert set(scheduler._until) == {("api_id", "7"), ("proxy", "socks5://10.0.0.1:1080")}
+
+
+def test_direct_connection_has_no_proxy_dimension(scheduler):
+    flood_call()
+    assert set(scheduler._until) == {("api_id", "7")}
+    assert ("proxy", "direct") not in scheduler.counts
+
+
+def test_final_flood_wait_carries_its_scope(scheduler):
+    manager, error = flood_call(seconds=0, phone="+8613800000000")
+    assert isinstance(error, main.telethon_errors.FloodWaitError)
+    assert error.flood_scope == "phone"
+    assert scheduler.counts[("phone", "+8613800000000")] == scheduler.max_attempts
+    assert manager.client.flood_sleep_threshold == 60
+
+
+def test_qr_login_goes_through_the_scheduler(scheduler, client, monkeypatch):
+    class FloodedClient(bench.FakeTelegramClient):
+        async def qr_login(self):
+            raise FloodWait(400)
+
+    monkeypatch.setattr(main, "create_client", FloodedClient)
+    flow_id = client.post("/api/flows", json={"api_id": "8", "api_hash": "x", "login_method": "qr"}).json()["flow_id"]
+    status = client.get(f"/api/flows/{flow_id}", params={"wait": 5}).json()
+    while not status["done"]:
+        status = client.get(f"/api/flows/{flow_id}", params={"after": status["last_seq"], "wait": 5}).json()
+    assert status["outcome"] == "flood_wait"
+    assert set(scheduler._until) == {("api_id", "8")}
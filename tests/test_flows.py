@@ -0,0 +1,99 @@
+"""登录流程: 准入排队、超时回收、断线暂存与重连续接"""
+import time
+
+from fastapi.testclient import TestClient
+
+import main
+
+
+def wait_until(predicate, timeout=5.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return
+        time.sleep(0.02)
+    raise AssertionError("等待超时")
+
+
+def create_flow(client, api_id="1"):
+    response = client.post("/api/flows", json={"api_id": api_id, "api_hash": "x", "login_method": "phone"})
+    assert response.status_code == 201
+    return response.json()["flow_id"]
+
+
+def flow_phase(client, flow_id):
+    return client.get(f"/api/flows/{flow_id}").json()["phase"]
+
+
+def receive_until(ws, message_type):
+    """读取消息直到出现指定类型，返回途中收到的全部消息"""
+    messages = []
+    while True:
+        message = ws.receive_json()
+        messages.append(message)
+        if message["type"] == message_type:
+            return messages
+
+
+def test_admission_queues_flows_over_the_api_id_limit(client, monkeypatch):
+    monkeypatch.setitem(main.ADMISSION.limits, "api_id", 2)
+    flow_ids = [create_flow(client, api_id="101") for _ in range(3)]
+    wait_until(lambda: [flow_phase(client, f) for f in flow_ids[:2]] == ["phone", "phone"])
+    assert flow_phase(client, flow_ids[2]) == "queued"
+    assert client.get("/api/admission").json()["queued_now"] == 1
+
+    # 其它 api_id 不受该上限影响，也不会被排在前面的请求挡住
+    other = create_flow(client, api_id="102")
+    wait_until(lambda: flow_phase(client, other) == "phone")
+
+    client.delete(f"/api/flows/{flow_ids[0]}")
+    wait_until(lambda: flow_phase(client, flow_ids[2]) == "phone")
+    assert client.get("/api/admission").json()["queued_now"] == 0
+    for flow_id in flow_ids[1:] + [other]:
+        client.delete(f"/api/flows/{flow_id}")
+
+
+def test_reaper_reclaims_flows_past_the_phase_deadline(monkeypatch):
+    monkeypatch.setitem(main.PHASE_DEADLINES, "phone", 0.2)
+    monkeypatch.setattr(main, "REAPER_INTERVAL", 0.1)
+    before = main.REAPER_STATS["by_reason"].get("phone", 0)
+    with TestClient(main.app) as client:
+        flow_id = create_flow(client)
+        wait_until(lambda: client.get(f"/api/flows/{flow_id}").status_code == 404)
+        assert client.get("/api/reaper").json()["by_reason"]["phone"] == before + 1
+
+
+def test_parked_flow_is_released_after_the_park_ttl(monkeypatch):
+    monkeypatch.setattr(main, "FLOW_PARK_TTL", 0.3)
+    monkeypatch.setattr(main, "REAPER_INTERVAL", 0.1)
+    with TestClient(main.app) as client:
+        with client.websocket_connect("/ws") as ws:
+            ws.send_json({"type": "init", "data": {"api_id": "1", "api_hash": "x", "login_method": "phone"}})
+            token = receive_until(ws, "flow")[-1]["token"]
+            receive_until(ws, "input_required")
+        assert main.FLOWS[token].parked_at is not None
+        wait_until(lambda: token not in main.FLOWS)
+        with client.websocket_connect("/ws") as ws:
+            ws.send_json({"type": "resume", "token": token})
+            assert ws.receive_json() == {"type": "resume_failed"}
+
+
+def test_flow_resumes_after_websocket_drop(client):
+    with client.websocket_connect("/ws") as ws:
+        ws.send_json({"type": "init", "data": {"api_id": "1", "api_hash": "x", "login_method": "phone"}})
+        token = receive_until(ws, "flow")[-1]["token"]
+        prompt = receive_until(ws, "input_required")[-1]
+
+    # 断线期间流程保留在暂存中，重连后先收到 resumed，再补发当前步骤
+    with client.websocket_connect("/ws") as ws:
+        ws.send_json({"type": "resume", "token": token})
+        messages = receive_until(ws, "input_required")
+        assert messages[0]["type"] == "resumed"
+        assert messages[-1]["prompt"] == prompt["prompt"]
+        ws.send_json({"type": "input_response", "data": "+8613800000000"})
+        receive_until(ws, "input_required")
+        ws.send_json({"type": "input_response", "data": "12345"})
+        messages = receive_until(ws, "done")
+    generated = [m for m in messages if m["type"] == "session_generated"]
+    assert len(generated) == 1
+    assert main.CATALOG.get(generated[0]["filename"]) is not None
@@ -0,0 +1,130 @@
+"""Session 格式转换与批量导出"""
+import base64
+import io
+import json
+import os
+import sqlite3
+import struct
+import tarfile
+import zipfile
+
+import pytest
+from telethon.crypto import AuthKey
+from telethon.sessions import StringSession
+
+import main
+
+
+def make_session(dc_id=4, address="149.154.167.91"):
+    session = StringSession()
+    session.set_dc(dc_id, address, 443)
+    session.auth_key = AuthKey(os.urandom(256))
+    return session.save()
+
+
+@pytest.fixture
+def saved():
+    """写入一个带 api_id 的 session，返回 (文件名, session 字符串)"""
+    string_session = make_session()
+    filename = "session_501_1700000501.txt"
+    main.CATALOG.save_session(filename, string_session,
+                              {"user_id": 501, "api_id": 77, "created_at": 1700000501, "dc_id": 4})
+    return filename, string_session
+
+
+def test_telethon_conversion_round_trip(client, saved, tmp_path):
+    filename, string_session = saved
+    response = client.get(f"/api/sessions/{filename}/convert", params={"format": "telethon"})
+    assert 'filename="session_501_1700000501.session"' in response.headers["content-disposition"]
+    path = tmp_path / "converted.session"
+    path.write_bytes(response.content)
+    with sqlite3.connect(str(path)) as db:
+        dc_id, address, port, auth_key = db.execute(
+            "select dc_id, server_address, port, auth_key from sessions").fetchone()
+    restored = StringSession()
+    restored.set_dc(dc_id, address, port)
+    restored.auth_key = AuthKey(auth_key)
+    assert restored.save() == string_session
+
+
+def test_pyrogram_conversion_round_trip(client, saved):
+    filename, string_session = saved
+    encoded = client.get(f"/api/sessions/{filename}/convert", params={"format": "pyrogram"}).text
+    dc_id, api_id, test_mode, auth_key, user_id, is_bot = struct.unpack(
+        ">BI?256sQ?", base64.urlsafe_b64decode(encoded + "=" * (-len(encoded) % 4)))
+    original = StringSession(string_session)
+    assert (dc_id, api_id, test_mode, user_id, is_bot) == (4, 77, False, 501, False)
+    assert auth_key == original.auth_key.key
+
+
+def test_pyrogram_conversion_requires_api_id(client):
+    main.CATALOG.save_session("session_502_1700000502.txt", make_session(),
+                              {"user_id": 502, "created_at": 1700000502, "dc_id": 4})
+    response = client.get("/api/sessions/session_502_1700000502.txt/convert", params={"format": "pyrogram"})
+    assert response.status_code == 400
+    response = client.get("/api/sessions/session_502_1700000502.txt/convert",
+                          params={"format": "pyrogram", "api_id": 9})
+    assert response.status_code == 200
+
+
+def test_json_conversion_round_trip(client, saved):
+    filename, string_session = saved
+    bundle = json.loads(client.get(f"/api/sessions/{filename}/convert", params={"format": "json"}).content)
+    restored = StringSession()
+    restored.set_dc(bundle["dc_id"], bundle["server_address"], bundle["port"])
+    restored.auth_key = AuthKey(bytes.fromhex(bundle["auth_key"]))
+    assert restored.save() == string_session
+    assert (bundle["user_id"], bundle["api_id"]) == (501, 77)
+
+
+@pytest.fixture
+def exported():
+    """三个分属两个 api_id 的 session，返回 {文件名: session 字符串}"""
+    sessions = {}
+    for user_id, api_id in ((601, 61), (602, 62), (603, 61)):
+        filename = f"session_{user_id}_{1700000000 + user_id}.txt"
+        sessions[filename] = make_session()
+        main.CATALOG.save_session(filename, sessions[filename], {
+            "user_id": user_id, "api_id": api_id, "created_at": 1700000000 + user_id, "dc_id": 4})
+    return sessions
+
+
+def test_zip_export_contains_filtered_sessions(client, exported):
+    response = client.get("/api/sessions/export", params={"format": "zip", "api_id": 61})
+    assert response.headers["content-type"] == "application/zip"
+    archive = zipfile.ZipFile(io.BytesIO(response.content))
+    assert archive.testzip() is None
+    assert sorted(archive.namelist()) == ["session_601_1700000601.txt", "session_603_1700000603.txt"]
+    for name in archive.namelist():
+        assert archive.read(name).decode() == exported[name]
+
+
+def test_tar_export_contains_selected_users(client, exported):
+    response = client.get("/api/sessions/export",
+                          params={"format": "tar.gz", "user_ids": "601,602", "since": 1700000602})
+    with tarfile.open(fileobj=io.BytesIO(response.content)) as archive:
+        members = archive.getmembers()
+        assert [m.name for m in members] == ["session_602_1700000602.txt"]
+        assert members[0].mtime == 1700000602
+        assert archive.extractfile(members[0]).read().decode() == exported["session_602_1700000602.txt"]
+
+
+def test_export_converts_each_session(client, exported):
+    response = client.get("/api/sessions/export", params={
+        "format": "zip", "user_ids": "601,602,603", "session_format": "pyrogram", "target_api_id": 9})
+    archive = zipfile.ZipFile(io.BytesIO(response.content))
+    assert sorted(archive.namelist()) == [
+        "session_601_1700000601.pyrogram.txt",
+        "session_602_1700000602.pyrogram.txt",
+        "session_603_1700000603.pyrogram.txt",
+    ]
+    encoded = archive.read("session_602_1700000602.pyrogram.txt").decode()
+    _, api_id, _, auth_key, user_id, _ = struct.unpack(
+        ">BI?256sQ?", base64.urlsafe_b64decode(encoded + "=" * (-len(encoded) % 4)))
+    assert (api_id, user_id) == (9, 602)
+    assert auth_key == StringSession(exported["session_602_1700000602.txt"]).auth_key.key
+
+
+def test_export_rejects_unknown_formats(client):
+    assert client.get("/api/sessions/export", params={"format": "rar"}).status_code == 400
+    assert client.get("/api/sessions/export", params={"session_format": "bogus"}).status_code == 400